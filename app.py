@@ -1,18 +1,43 @@
 import os
 
+import asyncio
+import gzip
+import hashlib
+import heapq
+import io
 import json
+import random
+import re
+import signal
+import socket
+import socketserver
+import sqlite3
+import stat
 import sys
-from googleapiclient.discovery import build
+import tempfile
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
 from urllib.parse import urlparse, parse_qs
 from datetime import datetime, timedelta
-from googleapiclient.errors import HttpError
-from youtube_transcript_api import YouTubeTranscriptApi
-import google.generativeai as genai
+from http import HTTPStatus
+# googleapiclient, youtube_transcript_api and google.generativeai are imported inside the
+# functions that talk to those services: they take hundreds of milliseconds to load, and
+# local commands like list and next never need them.
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
 
 # --- Configuration ---
 YOUTUBE_API_KEY = "API"
 GEMINI_API_KEY = "API" # IMPORTANT: Replace with your actual Gemini API key
 DATA_FILE = "mindfultube_data.json"
+INGEST_CHECKPOINT_FILE = "mindfultube_ingest.json" # In-flight add/sync progress for the JSON backend
 DAILY_VIDEO_LIMIT = 2 # Number of videos to "feed" per day
 
 # Define the order of usefulness for prioritization (lower index = higher priority)
@@ -26,16 +51,660 @@ USEFULNESS_ORDER = {
 }
 
 # --- Data Management ---
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        return {"playlists": {}, "last_fed_date": None}
-    with open(DATA_FILE, "r") as f:
-        return json.load(f)
-
-def save_data(data):
-    with open(DATA_FILE, "w") as f:
+STORAGE_BACKEND = "sqlite" # "sqlite" or "json"
+SQLITE_FILE = "mindfultube.db"
+
+def get_video_id(video_url):
+    parsed_url = urlparse(video_url)
+    return parse_qs(parsed_url.query).get('v', [None])[0]
+
+def build_video_index(data):
+    # Maps video ID -> record. A video listed in several playlists is collapsed into one
+    # shared record so that marking it fed or analyzing it applies everywhere.
+    index = {}
+    for playlist_info in data["playlists"].values():
+        videos = playlist_info["videos"]
+        for i, video in enumerate(videos):
+            video_id = get_video_id(video["url"])
+            existing = index.get(video_id)
+            if existing is None:
+                index[video_id] = video
+            elif existing is not video:
+                existing["fed"] = existing["fed"] or video["fed"]
+                for key, value in video.items():
+                    existing.setdefault(key, value)
+                videos[i] = existing
+    return index
+
+def parse_youtube_datetime(dt_str):
+    return datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
+
+def feed_rank(video):
+    return USEFULNESS_ORDER.get(video.get("usefulness_rating", "unknown"), len(USEFULNESS_ORDER))
+
+def published_timestamp(published_at):
+    return int(parse_youtube_datetime(published_at).timestamp())
+
+def backfill_published_ts(videos):
+    # Records written before published_ts existed only carry the publishedAt string.
+    for video in videos:
+        if "published_ts" not in video:
+            video["published_ts"] = published_timestamp(video["publishedAt"])
+
+def backfill_metadata_refreshed_ts(videos):
+    # Older records count as refreshed now so they don't all refetch on the next sync.
+    now = int(time.time())
+    for video in videos:
+        video.setdefault("metadata_refreshed_ts", now)
+
+def feed_priority(video):
+    # Usefulness ascending (highest priority first), then publishedAt descending (newest first)
+    return (feed_rank(video), -video["published_ts"])
+
+# Min-heap of unfed videos ordered by feed_priority. Re-keyed and removed entries are
+# invalidated in place and skipped when they reach the top (see the heapq docs recipe).
+class FeedQueue:
+    def __init__(self, videos=()):
+        self._heap = []
+        self._entries = {}
+        self._counter = 0
+        for video in videos:
+            if not video["fed"]:
+                self._heap.append(self._new_entry(video))
+        heapq.heapify(self._heap)
+
+    def _new_entry(self, video):
+        video_id = get_video_id(video["url"])
+        entry = [feed_priority(video), self._counter, video_id, video]
+        self._counter += 1
+        self._entries[video_id] = entry
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def remove(self, video_id):
+        entry = self._entries.pop(video_id, None)
+        if entry is not None:
+            entry[-1] = None
+
+    def update(self, video):
+        self.remove(get_video_id(video["url"]))
+        if not video["fed"]:
+            heapq.heappush(self._heap, self._new_entry(video))
+
+    def pop(self):
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            video = entry[-1]
+            if video is None:
+                continue
+            del self._entries[entry[2]]
+            if not video["fed"]:
+                return video
+        return None
+
+    def peek(self, limit):
+        videos = []
+        while len(videos) < limit:
+            video = self.pop()
+            if video is None:
+                break
+            videos.append(video)
+        for video in videos:
+            self.update(video)
+        return videos
+
+LOCK_FILE = "mindfultube.lock"
+
+# Read once at import, while nothing else can be creating files; os.umask can only be read by setting it.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+@contextmanager
+def atomic_replace(path, mode="w", durable=True):
+    # Yields a file for a temp copy of path and renames it over path once the block finishes,
+    # so a crash or Ctrl-C leaves either the old file or the new one, never a truncated mix.
+    # The temp file is removed if anything fails. durable=True also fsyncs the data and the
+    # rename; caches can skip that.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        # mkstemp creates the file 0600; keep the permissions the target had (or would get).
+        if hasattr(os, "fchmod"):
+            try:
+                file_mode = stat.S_IMODE(os.stat(path).st_mode)
+            except FileNotFoundError:
+                file_mode = 0o666 & ~_UMASK
+            os.fchmod(fd, file_mode)
+        f = os.fdopen(fd, mode)
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+    try:
+        with f:
+            yield f
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    if durable and hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd) # Persist the rename itself
+        finally:
+            os.close(dir_fd)
+
+def atomic_write_json(path, data):
+    with atomic_replace(path) as f:
         json.dump(data, f, indent=4)
 
+@contextmanager
+def data_lock(shared=False):
+    # Advisory lock serializing commands across processes. fcntl is POSIX-only; elsewhere
+    # commands run unlocked as before.
+    if fcntl is None:
+        yield
+        return
+    with open(LOCK_FILE, "a") as lock_file:
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(lock_file, mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("Waiting for another MindfulTube command to finish...", file=sys.stderr)
+            fcntl.flock(lock_file, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Keeps the whole library in one JSON file; every write rewrites the file.
+class JsonStore:
+    def __init__(self, path, checkpoint_path=None):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.checkpoints = None
+        self.data = None
+        self.file_stamp = None
+        self.index = None
+        self.feed_queue = None
+        self.source_playlist_urls = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            self.data = {"playlists": {}, "last_fed_date": None}
+        else:
+            with open(self.path, "r") as f:
+                self.data = json.load(f)
+        self.file_stamp = self._current_file_stamp()
+        self._reindex()
+        return self.data
+
+    def _current_file_stamp(self):
+        # Saves replace the file, so a new inode or mtime means another process wrote it.
+        try:
+            file_stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return file_stat.st_ino, file_stat.st_mtime_ns
+
+    def reload_if_changed(self):
+        # Long-running processes (serve, api, schedule) keep the data in memory between
+        # commands; call this under data_lock so writes from other processes aren't overwritten
+        # with a stale copy.
+        if self.data is not None and self.file_stamp != self._current_file_stamp():
+            self.load()
+        self.checkpoints = None
+
+    def _reindex(self):
+        self.index = build_video_index(self.data)
+        backfill_published_ts(self.index.values())
+        backfill_metadata_refreshed_ts(self.index.values())
+        self.feed_queue = FeedQueue(self.index.values())
+        self.source_playlist_urls = {}
+        for playlist_info in self.data["playlists"].values():
+            for video in playlist_info["videos"]:
+                self.source_playlist_urls.setdefault(video["url"], playlist_info["url"])
+
+    def _loaded(self):
+        if self.data is None:
+            self.load()
+        return self.data
+
+    def save(self, data):
+        if data is not self.data:
+            self.data = data
+            self._reindex()
+        atomic_write_json(self.path, data)
+        self.file_stamp = self._current_file_stamp()
+
+    def get_playlist(self, playlist_id):
+        return self._loaded()["playlists"].get(playlist_id)
+
+    def save_playlist(self, playlist_id, playlist):
+        self.save_playlists({playlist_id: playlist})
+
+    def save_playlists(self, playlists):
+        data = self._loaded()
+        data["playlists"].update(playlists)
+        self._reindex()
+        self.save(data)
+
+    def playlist_summaries(self):
+        for playlist_info in self._loaded()["playlists"].values():
+            total_videos = len(playlist_info["videos"])
+            fed_videos = sum(1 for v in playlist_info["videos"] if v["fed"])
+            yield playlist_info["url"], playlist_info["added_date"], total_videos, fed_videos
+
+    def find_video(self, video_url):
+        self._loaded()
+        return self.index.get(get_video_id(video_url))
+
+    def video_refresh_times(self):
+        self._loaded()
+        return {video_id: video["metadata_refreshed_ts"] for video_id, video in self.index.items()}
+
+    def update_video(self, video):
+        self.update_videos([video])
+
+    def update_videos(self, videos, meta=None):
+        # Records returned by find_video are the live objects, so only the feed order
+        # needs re-keying before the rewrite. meta keys are written in the same save.
+        data = self._loaded()
+        for video in videos:
+            self.feed_queue.update(video)
+        data.update(meta or {})
+        self.save(data)
+
+    def next_feed_videos(self, limit):
+        self._loaded()
+        return [(video, self.source_playlist_urls[video["url"]]) for video in self.feed_queue.peek(limit)]
+
+    # Checkpoints are rewritten after every page, so they live in their own small file
+    # instead of forcing a rewrite of the whole data file each time.
+    def _loaded_checkpoints(self):
+        if self.checkpoints is None:
+            self.checkpoints = {}
+            if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+                with open(self.checkpoint_path, "r") as f:
+                    self.checkpoints = json.load(f)
+        return self.checkpoints
+
+    def _save_checkpoints(self):
+        if self.checkpoint_path:
+            atomic_write_json(self.checkpoint_path, self.checkpoints)
+
+    def load_ingest_checkpoint(self, playlist_id):
+        return self._loaded_checkpoints().get(playlist_id)
+
+    def start_ingest_checkpoint(self, playlist_id, etag):
+        self._loaded_checkpoints()[playlist_id] = {"etag": etag, "next_page_token": None, "pages": {}, "videos": {}}
+        self._save_checkpoints()
+
+    def checkpoint_ingest_page(self, playlist_id, page_key, page, next_page_token):
+        checkpoint = self.load_ingest_checkpoint(playlist_id)
+        checkpoint["pages"][page_key] = page
+        checkpoint["next_page_token"] = next_page_token
+        self._save_checkpoints()
+
+    def checkpoint_ingest_videos(self, playlist_id, videos):
+        checkpoint = self.load_ingest_checkpoint(playlist_id)
+        for video in videos:
+            checkpoint["videos"][get_video_id(video["url"])] = video
+        self._save_checkpoints()
+
+    def clear_ingest_checkpoint(self, playlist_id):
+        if self._loaded_checkpoints().pop(playlist_id, None) is not None:
+            self._save_checkpoints()
+
+    def get_meta(self, key):
+        return self._loaded().get(key)
+
+    def set_meta(self, key, value):
+        data = self._loaded()
+        data[key] = value
+        self.save(data)
+
+# Each entry upgrades the schema by one version (tracked in PRAGMA user_version).
+SQLITE_MIGRATIONS = [
+    """
+    CREATE TABLE playlists (
+        playlist_id TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        added_date TEXT
+    );
+    CREATE TABLE videos (
+        video_id TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        published_at TEXT,
+        title TEXT,
+        description TEXT,
+        fed INTEGER NOT NULL DEFAULT 0,
+        summary TEXT,
+        usefulness_rating TEXT,
+        actionable_points TEXT
+    );
+    CREATE TABLE playlist_videos (
+        playlist_id TEXT NOT NULL REFERENCES playlists(playlist_id) ON DELETE CASCADE,
+        video_id TEXT NOT NULL REFERENCES videos(video_id),
+        position INTEGER NOT NULL,
+        PRIMARY KEY (playlist_id, video_id)
+    );
+    CREATE INDEX idx_playlist_videos_video ON playlist_videos(video_id);
+    CREATE INDEX idx_videos_fed ON videos(fed);
+    CREATE TABLE meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """,
+    # The feed order lives in an index so `next` reads the top entries instead of scanning.
+    """
+    ALTER TABLE videos ADD COLUMN feed_rank INTEGER NOT NULL DEFAULT %d;
+    UPDATE videos SET feed_rank = CASE COALESCE(usefulness_rating, 'unknown') %s ELSE %d END;
+    CREATE INDEX idx_videos_feed ON videos(fed, feed_rank, published_at DESC);
+    """ % (
+        USEFULNESS_ORDER["unknown"],
+        " ".join(f"WHEN '{rating}' THEN {rank}" for rating, rank in USEFULNESS_ORDER.items()),
+        len(USEFULNESS_ORDER),
+    ),
+    """
+    ALTER TABLE videos ADD COLUMN published_ts INTEGER;
+    UPDATE videos SET published_ts = CAST(strftime('%s', published_at) AS INTEGER);
+    DROP INDEX idx_videos_feed;
+    CREATE INDEX idx_videos_feed ON videos(fed, feed_rank, published_ts DESC);
+    """,
+    # Etags from the last sync, used for conditional requests; pages is a JSON object.
+    """
+    ALTER TABLE playlists ADD COLUMN etag TEXT;
+    ALTER TABLE playlists ADD COLUMN pages TEXT;
+    """,
+    """
+    ALTER TABLE videos ADD COLUMN metadata_refreshed_ts INTEGER;
+    UPDATE videos SET metadata_refreshed_ts = CAST(strftime('%s', 'now') AS INTEGER);
+    """,
+    # Progress of an in-flight add/sync, written page by page so it can resume after a crash.
+    """
+    CREATE TABLE ingest_checkpoints (
+        playlist_id TEXT PRIMARY KEY,
+        etag TEXT,
+        next_page_token TEXT
+    );
+    CREATE TABLE ingest_pages (
+        playlist_id TEXT NOT NULL REFERENCES ingest_checkpoints(playlist_id) ON DELETE CASCADE,
+        page_key TEXT NOT NULL,
+        page TEXT NOT NULL,
+        PRIMARY KEY (playlist_id, page_key)
+    );
+    CREATE TABLE ingest_videos (
+        playlist_id TEXT NOT NULL REFERENCES ingest_checkpoints(playlist_id) ON DELETE CASCADE,
+        video_id TEXT NOT NULL,
+        video TEXT NOT NULL,
+        PRIMARY KEY (playlist_id, video_id)
+    );
+    """,
+]
+
+# Splits a migration script into statements so they can run inside the caller's transaction.
+def _split_sql(script):
+    statements, current = [], ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current)
+            current = ""
+    return statements
+
+VIDEO_COLUMNS = ("video_id", "url", "published_at", "title", "description", "fed",
+                 "summary", "usefulness_rating", "actionable_points", "feed_rank", "published_ts",
+                 "metadata_refreshed_ts")
+
+# Stores playlists and videos as indexed tables so single-video updates touch one row.
+class SqliteStore:
+    def __init__(self, path, legacy_json_path=None):
+        self.path = path
+        # The serve daemon runs each command on a handler thread; commands never overlap
+        # (see CommandHandler), so sharing the connection across threads is safe.
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.index = None
+        self._migrate(legacy_json_path)
+
+    def _migrate(self, legacy_json_path):
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] == len(SQLITE_MIGRATIONS):
+            return
+        # executescript() commits on its own, so the steps run statement by statement inside one
+        # write transaction: a failed step, a concurrent first start, or an interrupted JSON import
+        # leaves the database exactly as it was. The version is re-read once the lock is held in
+        # case another process has just migrated it.
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            for i in range(version, len(SQLITE_MIGRATIONS)):
+                for statement in _split_sql(SQLITE_MIGRATIONS[i]):
+                    self.conn.execute(statement)
+                self.conn.execute(f"PRAGMA user_version = {i + 1}")
+            if version == 0 and legacy_json_path and os.path.exists(legacy_json_path):
+                self._import_json(legacy_json_path)
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+    def _import_json(self, json_path):
+        print(f"Migrating existing data from {json_path} to {self.path}...", file=sys.stderr)
+        data = JsonStore(json_path).load() # Backfills published_ts on load
+        self._replace_all(data)
+
+    @staticmethod
+    def _video_to_row(video):
+        points = video.get("actionable_points")
+        return (
+            get_video_id(video["url"]),
+            video["url"],
+            video.get("publishedAt"),
+            video.get("title"),
+            video.get("description"),
+            1 if video.get("fed") else 0,
+            video.get("summary"),
+            video.get("usefulness_rating"),
+            json.dumps(points) if points is not None else None,
+            feed_rank(video),
+            video["published_ts"],
+            video["metadata_refreshed_ts"],
+        )
+
+    @staticmethod
+    def _row_to_playlist(row, videos):
+        playlist = {"url": row["url"], "videos": videos, "added_date": row["added_date"]}
+        if row["etag"] is not None:
+            playlist["etag"] = row["etag"]
+        if row["pages"] is not None:
+            playlist["pages"] = json.loads(row["pages"])
+        return playlist
+
+    @staticmethod
+    def _row_to_video(row):
+        video = {
+            "url": row["url"],
+            "publishedAt": row["published_at"],
+            "published_ts": row["published_ts"],
+            "title": row["title"],
+            "description": row["description"],
+            "metadata_refreshed_ts": row["metadata_refreshed_ts"],
+            "fed": bool(row["fed"]),
+        }
+        # Analysis fields are only present once a video has been analyzed.
+        if row["summary"] is not None:
+            video["summary"] = row["summary"]
+        if row["usefulness_rating"] is not None:
+            video["usefulness_rating"] = row["usefulness_rating"]
+        if row["actionable_points"] is not None:
+            video["actionable_points"] = json.loads(row["actionable_points"])
+        return video
+
+    def _upsert_videos(self, videos):
+        placeholders = ", ".join("?" for _ in VIDEO_COLUMNS)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in VIDEO_COLUMNS[1:])
+        self.conn.executemany(
+            f"INSERT INTO videos ({', '.join(VIDEO_COLUMNS)}) VALUES ({placeholders}) "
+            f"ON CONFLICT(video_id) DO UPDATE SET {updates}",
+            [self._video_to_row(v) for v in videos]
+        )
+
+    def _write_playlist(self, playlist_id, playlist):
+        pages = playlist.get("pages")
+        self.conn.execute(
+            "INSERT INTO playlists (playlist_id, url, added_date, etag, pages) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(playlist_id) DO UPDATE SET url = excluded.url, added_date = excluded.added_date, "
+            "etag = excluded.etag, pages = excluded.pages",
+            (playlist_id, playlist["url"], playlist.get("added_date"), playlist.get("etag"),
+             json.dumps(pages) if pages is not None else None)
+        )
+        self._upsert_videos(playlist["videos"])
+        self.conn.execute("DELETE FROM playlist_videos WHERE playlist_id = ?", (playlist_id,))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO playlist_videos (playlist_id, video_id, position) VALUES (?, ?, ?)",
+            [(playlist_id, get_video_id(v["url"]), i) for i, v in enumerate(playlist["videos"])]
+        )
+
+    def _delete_orphan_videos(self):
+        self.conn.execute("DELETE FROM videos WHERE video_id NOT IN (SELECT video_id FROM playlist_videos)")
+
+    def load(self):
+        videos = {row["video_id"]: self._row_to_video(row) for row in self.conn.execute("SELECT * FROM videos")}
+        playlists = {}
+        for row in self.conn.execute("SELECT * FROM playlists ORDER BY rowid"):
+            playlists[row["playlist_id"]] = self._row_to_playlist(row, [])
+        for row in self.conn.execute("SELECT playlist_id, video_id FROM playlist_videos ORDER BY playlist_id, position"):
+            playlists[row["playlist_id"]]["videos"].append(videos[row["video_id"]])
+        # The videos table (keyed by video_id) is the persisted index; keep the loaded copy too.
+        self.index = videos
+        return {"playlists": playlists, "last_fed_date": self.get_meta("last_fed_date")}
+
+    def save(self, data):
+        with self.conn:
+            self._replace_all(data)
+
+    def _replace_all(self, data):
+        self.conn.execute("DELETE FROM playlist_videos")
+        self.conn.execute("DELETE FROM playlists WHERE playlist_id NOT IN (%s)" % ", ".join("?" for _ in data["playlists"]),
+                          list(data["playlists"]))
+        for playlist_id, playlist in data["playlists"].items():
+            self._write_playlist(playlist_id, playlist)
+        self._delete_orphan_videos()
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_fed_date', ?)", (data.get("last_fed_date"),))
+
+    def get_playlist(self, playlist_id):
+        row = self.conn.execute("SELECT * FROM playlists WHERE playlist_id = ?", (playlist_id,)).fetchone()
+        if row is None:
+            return None
+        videos = [self._row_to_video(v) for v in self.conn.execute(
+            "SELECT v.* FROM playlist_videos pv JOIN videos v ON v.video_id = pv.video_id "
+            "WHERE pv.playlist_id = ? ORDER BY pv.position", (playlist_id,))]
+        return self._row_to_playlist(row, videos)
+
+    def save_playlist(self, playlist_id, playlist):
+        self.save_playlists({playlist_id: playlist})
+
+    def save_playlists(self, playlists):
+        with self.conn:
+            for playlist_id, playlist in playlists.items():
+                self._write_playlist(playlist_id, playlist)
+            self._delete_orphan_videos()
+
+    def playlist_summaries(self):
+        rows = self.conn.execute(
+            "SELECT p.url, p.added_date, COUNT(v.video_id) AS total, COALESCE(SUM(v.fed), 0) AS fed "
+            "FROM playlists p LEFT JOIN playlist_videos pv ON pv.playlist_id = p.playlist_id "
+            "LEFT JOIN videos v ON v.video_id = pv.video_id GROUP BY p.playlist_id ORDER BY p.rowid"
+        )
+        for row in rows:
+            yield row["url"], row["added_date"], row["total"], row["fed"]
+
+    def find_video(self, video_url):
+        row = self.conn.execute("SELECT * FROM videos WHERE video_id = ?", (get_video_id(video_url),)).fetchone()
+        return self._row_to_video(row) if row else None
+
+    def video_refresh_times(self):
+        return {row[0]: row[1] for row in self.conn.execute("SELECT video_id, metadata_refreshed_ts FROM videos")}
+
+    def update_video(self, video):
+        self.update_videos([video])
+
+    def update_videos(self, videos, meta=None):
+        with self.conn:
+            self._upsert_videos(videos)
+            self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (meta or {}).items())
+
+    def next_feed_videos(self, limit):
+        rows = self.conn.execute(
+            "SELECT v.*, (SELECT p.url FROM playlist_videos pv JOIN playlists p ON p.playlist_id = pv.playlist_id "
+            "WHERE pv.video_id = v.video_id ORDER BY p.rowid LIMIT 1) AS playlist_url "
+            "FROM videos v WHERE v.fed = 0 ORDER BY v.feed_rank, v.published_ts DESC LIMIT ?", (limit,)
+        )
+        return [(self._row_to_video(row), row["playlist_url"]) for row in rows]
+
+    def load_ingest_checkpoint(self, playlist_id):
+        row = self.conn.execute("SELECT * FROM ingest_checkpoints WHERE playlist_id = ?", (playlist_id,)).fetchone()
+        if row is None:
+            return None
+        pages = {r["page_key"]: json.loads(r["page"]) for r in self.conn.execute(
+            "SELECT page_key, page FROM ingest_pages WHERE playlist_id = ?", (playlist_id,))}
+        videos = {r["video_id"]: json.loads(r["video"]) for r in self.conn.execute(
+            "SELECT video_id, video FROM ingest_videos WHERE playlist_id = ?", (playlist_id,))}
+        return {"etag": row["etag"], "next_page_token": row["next_page_token"], "pages": pages, "videos": videos}
+
+    def start_ingest_checkpoint(self, playlist_id, etag):
+        with self.conn:
+            self.conn.execute("DELETE FROM ingest_checkpoints WHERE playlist_id = ?", (playlist_id,))
+            self.conn.execute("INSERT INTO ingest_checkpoints (playlist_id, etag) VALUES (?, ?)", (playlist_id, etag))
+
+    def checkpoint_ingest_page(self, playlist_id, page_key, page, next_page_token):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO ingest_pages (playlist_id, page_key, page) VALUES (?, ?, ?)",
+                              (playlist_id, page_key, json.dumps(page)))
+            self.conn.execute("UPDATE ingest_checkpoints SET next_page_token = ? WHERE playlist_id = ?",
+                              (next_page_token, playlist_id))
+
+    def checkpoint_ingest_videos(self, playlist_id, videos):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ingest_videos (playlist_id, video_id, video) VALUES (?, ?, ?)",
+                [(playlist_id, get_video_id(v["url"]), json.dumps(v)) for v in videos]
+            )
+
+    def clear_ingest_checkpoint(self, playlist_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM ingest_checkpoints WHERE playlist_id = ?", (playlist_id,))
+
+    def reload_if_changed(self):
+        pass # Every read goes to the database, so there is no in-memory copy to go stale
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        if STORAGE_BACKEND == "sqlite":
+            _store = SqliteStore(SQLITE_FILE, legacy_json_path=DATA_FILE)
+        else:
+            _store = JsonStore(DATA_FILE, checkpoint_path=INGEST_CHECKPOINT_FILE)
+    return _store
+
 def clean_description(description):
     # Replace common problematic characters for JSON
     description = description.replace("\n", " ") # Replace newlines with spaces
@@ -61,10 +730,188 @@ def normalize_youtube_url(url):
         return f"https://www.youtube.com/watch?v={video_id}"
     return url # Return original if not a recognized YouTube video URL
 
+# --- Rate Limiting ---
+YOUTUBE_UNITS_PER_DAY = 10000 # YouTube Data API quota; list calls cost 1 unit each
+YOUTUBE_MAX_CONCURRENCY = 8
+GEMINI_REQUESTS_PER_MINUTE = 10
+GEMINI_TOKENS_PER_MINUTE = 250000
+GEMINI_MAX_CONCURRENCY = 4
+TRANSCRIPT_REQUESTS_PER_MINUTE = 60
+TRANSCRIPT_MAX_CONCURRENCY = 4
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate # Units refilled per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        # Blocks until amount units are available. Requests larger than the bucket just wait for a full one.
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+# AIMD concurrency limit: +1 slot per window of successful calls, halved on a quota error.
+class AdaptiveConcurrency:
+    DECREASE_COOLDOWN = 1.0 # Seconds; errors from one burst of in-flight calls halve the limit once
+
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.active = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, outcome):
+        # outcome is "ok", "throttled" or "error" (other failures leave the limit alone).
+        with self._cond:
+            self.active -= 1
+            if outcome == "ok":
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif outcome == "throttled":
+                now = time.monotonic()
+                if now - self._last_decrease >= self.DECREASE_COOLDOWN:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+            self._cond.notify_all()
+
+def is_http_error(error):
+    # googleapiclient is imported lazily; if it was never loaded, nothing raised an HttpError.
+    errors = sys.modules.get("googleapiclient.errors")
+    return errors is not None and isinstance(error, errors.HttpError)
+
+def is_quota_error(error):
+    if is_http_error(error):
+        if error.resp.status == 429:
+            return True
+        content = error.content.decode(errors="replace") if isinstance(error.content, bytes) else str(error.content)
+        return error.resp.status == 403 and ("quota" in content.lower() or "ratelimit" in content.lower())
+    # google.api_core raises ResourceExhausted (HTTP 429) for Gemini rate limits
+    return getattr(error, "code", None) == 429 or type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+class ServiceLimiter:
+    def __init__(self, name, max_concurrency, **buckets):
+        self.name = name
+        self.buckets = buckets
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+
+    @contextmanager
+    def slot(self, **costs):
+        # Waits for every bucket named in costs (e.g. units=1, tokens=1200) and a free
+        # concurrency slot, then reports how the wrapped call went back to the AIMD limit.
+        for bucket_name, amount in costs.items():
+            self.buckets[bucket_name].acquire(amount)
+        self.concurrency.acquire()
+        outcome = "ok"
+        try:
+            yield
+        except Exception as e:
+            outcome = "throttled" if is_quota_error(e) else "error"
+            raise
+        finally:
+            self.concurrency.release(outcome)
+
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0 # Seconds; doubles on every attempt
+RETRY_MAX_DELAY = 32.0
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+def is_retryable_error(error):
+    if is_http_error(error):
+        if error.resp.status in RETRYABLE_STATUSES:
+            return True
+        # Short-term rate limits clear up; an exhausted daily quota ("quotaExceeded") does not.
+        content = error.content.decode(errors="replace") if isinstance(error.content, bytes) else str(error.content)
+        return error.resp.status == 403 and "ratelimitexceeded" in content.lower()
+    if isinstance(error, (ConnectionError, TimeoutError, OSError)):
+        return True
+    # google.api_core errors (Gemini) carry the HTTP status as .code
+    return getattr(error, "code", None) in RETRYABLE_STATUSES
+
+def call_with_retries(description, fn, *args, **kwargs):
+    # Retries transient failures with capped exponential backoff and full jitter.
+    for attempt in range(RETRY_ATTEMPTS):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt + 1 >= RETRY_ATTEMPTS or not is_retryable_error(e):
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            print(f"WARNING: {description} failed ({e}); retrying in {delay:.1f}s "
+                  f"(attempt {attempt + 2} of {RETRY_ATTEMPTS})...", file=sys.stderr)
+            time.sleep(delay)
+
+youtube_limiter = ServiceLimiter(
+    "youtube", YOUTUBE_MAX_CONCURRENCY,
+    units=TokenBucket(YOUTUBE_UNITS_PER_DAY / 86400, YOUTUBE_UNITS_PER_DAY)
+)
+gemini_limiter = ServiceLimiter(
+    "gemini", GEMINI_MAX_CONCURRENCY,
+    requests=TokenBucket(GEMINI_REQUESTS_PER_MINUTE / 60, GEMINI_REQUESTS_PER_MINUTE),
+    tokens=TokenBucket(GEMINI_TOKENS_PER_MINUTE / 60, GEMINI_TOKENS_PER_MINUTE)
+)
+transcript_limiter = ServiceLimiter(
+    "transcript", TRANSCRIPT_MAX_CONCURRENCY,
+    requests=TokenBucket(TRANSCRIPT_REQUESTS_PER_MINUTE / 60, TRANSCRIPT_REQUESTS_PER_MINUTE)
+)
+
 # --- YouTube API Interaction ---
 
+YOUTUBE_DISCOVERY_FILE = "youtube_v3_discovery.json"
+YOUTUBE_DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/youtube/v3/rest"
+
+_youtube_service = None
+_youtube_service_lock = threading.Lock()
+
+def load_youtube_discovery_document():
+    # Prefer the local copy, then the document bundled with googleapiclient (2.x ships static
+    # discovery docs), and only hit the network when neither exists. Whatever we get is saved
+    # next to the data file so later runs, and offline ones, skip the lookup.
+    if os.path.exists(YOUTUBE_DISCOVERY_FILE):
+        with open(YOUTUBE_DISCOVERY_FILE, "r") as f:
+            return json.load(f)
+    document = None
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+        document = get_static_doc("youtube", "v3")
+    except ImportError: # googleapiclient < 2.0
+        pass
+    if document is None:
+        from googleapiclient.http import build_http
+        resp, document = build_http().request(YOUTUBE_DISCOVERY_URL)
+        if resp.status != 200:
+            raise RuntimeError(f"Could not download the YouTube discovery document: HTTP {resp.status}")
+    if isinstance(document, bytes):
+        document = document.decode()
+    document = json.loads(document)
+    atomic_write_json(YOUTUBE_DISCOVERY_FILE, document)
+    return document
+
 def get_youtube_service():
-    return build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
+    # Built once per process and shared by every playlist; requests still execute on
+    # per-thread http objects (see _execute_once), so sharing the client is safe.
+    global _youtube_service
+    with _youtube_service_lock:
+        if _youtube_service is None:
+            from googleapiclient.discovery import build_from_document
+            _youtube_service = build_from_document(load_youtube_discovery_document(), developerKey=YOUTUBE_API_KEY)
+        return _youtube_service
 
 def get_playlist_id(url):
     parsed_url = urlparse(url)
@@ -74,63 +921,365 @@ def get_playlist_id(url):
         return None
     return None
 
-def get_playlist_items(youtube, playlist_id):
-    video_ids = []
-    next_page_token = None
-
-    while True:
-        request = youtube.playlistItems().list(
-            part="contentDetails",
-            playlistId=playlist_id,
-            maxResults=50,
-            pageToken=next_page_token
-        )
-        response = request.execute()
+PLAYLIST_FETCH_CONCURRENCY = 4 # Playlists fetched at the same time by sync --all
+DETAIL_PREFETCH = 4 # Pages of video details fetched ahead of the consumer of a playlist fetch
+METADATA_REFRESH_DAYS = 30 # Re-fetch title/description of known videos this often, even in unchanged playlists (None = never)
 
-        for item in response["items"]:
-            # Check if contentDetails and videoId exist, indicating it's a video
-            if "contentDetails" in item and "videoId" in item["contentDetails"]:
-                video_ids.append(item["contentDetails"]["videoId"])
-            else:
-                print(f"WARNING: Skipping non-video item or item with unexpected structure in playlist: {item.get('id', 'Unknown ID')}", file=sys.stderr)
+_thread_local = threading.local()
 
-        next_page_token = response.get("nextPageToken")
-        if not next_page_token:
-            break
+def _execute_once(request):
+    # httplib2 connections are not thread-safe, so each worker thread gets its own.
+    if not hasattr(_thread_local, "http"):
+        from googleapiclient.http import build_http
+        _thread_local.http = build_http()
+    with youtube_limiter.slot(units=1):
+        return request.execute(http=_thread_local.http)
+
+def execute_request(request):
+    # A failed page is retried on its own, so paging resumes from the last good page token.
+    return call_with_retries(f"YouTube API request {request.methodId}", _execute_once, request)
+
+def parse_playlist_page(response):
+    video_ids = []
+    for item in response["items"]:
+        # Check if contentDetails and videoId exist, indicating it's a video
+        if "contentDetails" in item and "videoId" in item["contentDetails"]:
+            video_ids.append(item["contentDetails"]["videoId"])
+        else:
+            print(f"WARNING: Skipping non-video item or item with unexpected structure in playlist: {item.get('id', 'Unknown ID')}", file=sys.stderr)
+    return video_ids
 
+def parse_video_details(videos_response):
     videos_data = []
-    for i in range(0, len(video_ids), 50):
-        batch_ids = video_ids[i:i+50]
-        videos_request = youtube.videos().list(
-            part="snippet",
-            id=",".join(batch_ids)
-        )
-        videos_response = videos_request.execute()
-
-        for item in videos_response["items"]:
-            video_id = item["id"]
-            published_at = item["snippet"]["publishedAt"]
-            title = item["snippet"]["title"]
-            description = clean_description(item["snippet"]["description"])
-            videos_data.append({
-                "url": normalize_youtube_url(f"https://www.youtube.com/watch?v={video_id}"), # Normalize URL here
-                "publishedAt": published_at,
-                "title": title,
-                "description": description,
-                "fed": False # Initial status
-            })
+    for item in videos_response["items"]:
+        video_id = item["id"]
+        published_at = item["snippet"]["publishedAt"]
+        title = item["snippet"]["title"]
+        description = clean_description(item["snippet"]["description"])
+        videos_data.append({
+            "url": normalize_youtube_url(f"https://www.youtube.com/watch?v={video_id}"), # Normalize URL here
+            "publishedAt": published_at,
+            "published_ts": published_timestamp(published_at),
+            "title": title,
+            "description": description,
+            "metadata_refreshed_ts": int(time.time()),
+            "fed": False # Initial status
+        })
     return videos_data
 
-def get_video_transcript(video_id):
+def is_not_modified(error):
+    return is_http_error(error) and error.resp.status == 304
+
+async def execute_conditional(request, etag):
+    # Sends If-None-Match when we hold an etag; returns None when YouTube answers 304.
+    if etag:
+        request.headers["If-None-Match"] = etag
     try:
-        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-        # Try to get an English transcript first
-        transcript = transcript_list.find_transcript(['en', 'en-US'])
-        fetched_data = transcript.fetch()
-        return " ".join([t.text for t in fetched_data])
+        return await asyncio.to_thread(execute_request, request)
+    except Exception as e:
+        if is_not_modified(e):
+            return None
+        raise
+
+async def iter_playlist_changes_async(youtube, playlist_id, playlist, refresh_times, store=None):
+    # Pages through a playlist, handing each page's IDs to a videos().list fetch as soon as
+    # it arrives, driven by the etags saved on the playlist record. refresh_times maps every
+    # video ID the store knows to the epoch seconds of its last details fetch. Yields nothing
+    # when the playlist itself is unchanged (304); otherwise one batch per page, in playlist
+    # order: {"etag": playlist etag, "page_key", "page", "videos": {video_id: record}}, where
+    # "videos" only holds the page's IDs that are new, whose playlist item etag changed, or
+    # whose details are older than METADATA_REFRESH_DAYS. Details for up to DETAIL_PREFETCH
+    # pages are fetched ahead of the consumer, so memory stays bounded by a few pages.
+    #
+    # With a store, every page and every batch of details is checkpointed as it arrives and
+    # an interrupted run resumes from the saved next page token while the playlist etag
+    # still matches. The caller clears the checkpoint once the merged playlist is saved.
+    old_pages = playlist.get("pages") or {}
+    old_item_etags = {}
+    for page in old_pages.values():
+        old_item_etags.update(page["item_etags"])
+
+    stale_before = None
+    if METADATA_REFRESH_DAYS is not None:
+        stale_before = time.time() - METADATA_REFRESH_DAYS * 86400
+
+    def needs_details(video_id, item_etag):
+        if video_id not in refresh_times:
+            return True
+        # Known through another playlist (no old item etag here) counts as unchanged.
+        old_item_etag = old_item_etags.get(video_id)
+        if old_item_etag is not None and old_item_etag != item_etag:
+            return True
+        return stale_before is not None and refresh_times[video_id] < stale_before
+
+    checkpoint = store.load_ingest_checkpoint(playlist_id) if store else None
+    if checkpoint:
+        # Only resume while the playlist is still the one the checkpoint was taken from:
+        # a 304 against its etag confirms that, anything else starts the fetch over.
+        request_etag = checkpoint["etag"]
+    else:
+        # A 304 on the playlist would end the sync before any page is looked at, so when a
+        # video here is due for a metadata refresh, ask for the playlist unconditionally.
+        # Unchanged pages still answer 304 and only the stale videos are re-fetched.
+        request_etag = playlist.get("etag")
+        if stale_before is not None and any(refresh_times.get(vid, stale_before) < stale_before
+                                            for page in old_pages.values() for vid in page["video_ids"]):
+            request_etag = None
+    playlist_request = youtube.playlists().list(part="contentDetails", id=playlist_id)
+    playlist_response = await execute_conditional(playlist_request, request_etag)
+    if checkpoint and playlist_response is not None and playlist_response["etag"] != checkpoint["etag"]:
+        print(f"Playlist {playlist_id} changed since the interrupted fetch; starting over.")
+        checkpoint = None
+
+    if checkpoint:
+        playlist_etag = checkpoint["etag"]
+        saved_pages = checkpoint["pages"]
+        saved_videos = checkpoint["videos"]
+        print(f"Resuming interrupted fetch of playlist {playlist_id} "
+              f"({len(saved_pages)} pages, {len(saved_videos)} videos already fetched).")
+    else:
+        if playlist_response is None:
+            return
+        playlist_etag = playlist_response["etag"]
+        saved_pages = {}
+        saved_videos = {}
+        if store:
+            store.start_ingest_checkpoint(playlist_id, playlist_etag)
+
+    async def fetch_details(video_ids):
+        if not video_ids:
+            return {}
+        videos_request = youtube.videos().list(part="snippet", id=",".join(video_ids))
+        videos_response = await asyncio.to_thread(execute_request, videos_request)
+        fetched = parse_video_details(videos_response)
+        if store:
+            store.checkpoint_ingest_videos(playlist_id, fetched)
+        return {get_video_id(video["url"]): video for video in fetched}
+
+    # Each entry is (page_key, page, details already saved, task fetching the rest).
+    pending = deque()
+
+    def queue_page(page_key, page):
+        # Only the delta against the local index (and any saved details) goes to videos().list.
+        saved = {vid: saved_videos[vid] for vid in page["video_ids"] if vid in saved_videos}
+        missing = [vid for vid in page["video_ids"]
+                   if vid not in saved and needs_details(vid, page["item_etags"].get(vid))]
+        pending.append((page_key, page, saved, asyncio.create_task(fetch_details(missing))))
+
+    async def next_batch():
+        page_key, page, videos, task = pending.popleft()
+        videos.update(await task)
+        return {"etag": playlist_etag, "page_key": page_key, "page": page, "videos": videos}
+
+    try:
+        # Pages saved by an interrupted run come first; page_key ends up at the first page
+        # still to request, or None when every page was already saved.
+        page_key = ""
+        while page_key is not None and page_key in saved_pages:
+            queue_page(page_key, saved_pages[page_key])
+            page_key = saved_pages[page_key]["next_page_token"]
+
+        first_request = True
+        while page_key is not None:
+            cached_page = old_pages.get(page_key)
+            request = youtube.playlistItems().list(
+                part="contentDetails",
+                playlistId=playlist_id,
+                maxResults=50,
+                pageToken=page_key or None
+            )
+            try:
+                response = await execute_conditional(request, cached_page["etag"] if cached_page else None)
+            except Exception as e:
+                # A 4xx on the first page after resuming (an expired page token, say) means the
+                # saved progress is no good. Nothing has been yielded yet, so drop it and fetch
+                # from the first page. Quota errors are not the checkpoint's fault.
+                if not (checkpoint and first_request and is_http_error(e) and 400 <= e.resp.status < 500
+                        and not is_quota_error(e)):
+                    raise
+                print(f"Could not resume the fetch of playlist {playlist_id} ({e.resp.status}); starting over.")
+                tasks = [entry[3] for entry in pending]
+                pending.clear()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                store.clear_ingest_checkpoint(playlist_id)
+                async for batch in iter_playlist_changes_async(youtube, playlist_id, playlist, refresh_times, store):
+                    yield batch
+                return
+            first_request = False
+
+            if response is None:
+                page = cached_page # Page unchanged: reuse its IDs and item etags
+            else:
+                page_ids = parse_playlist_page(response)
+                item_etags = {item["contentDetails"]["videoId"]: item["etag"]
+                              for item in response["items"] if "videoId" in item.get("contentDetails", {})}
+                page = {
+                    "etag": response["etag"],
+                    "video_ids": page_ids,
+                    "item_etags": item_etags,
+                    "next_page_token": response.get("nextPageToken"),
+                }
+            if store:
+                store.checkpoint_ingest_page(playlist_id, page_key, page, page["next_page_token"])
+            queue_page(page_key, page)
+            page_key = page["next_page_token"]
+
+            while len(pending) > DETAIL_PREFETCH:
+                yield await next_batch()
+
+        while pending:
+            yield await next_batch()
+    finally:
+        # Stops detail fetches still queued when the consumer stops early or a page fails.
+        for entry in pending:
+            entry[3].cancel()
+
+async def gather_playlists_async(playlist_ids, fetch):
+    # Runs fetch(playlist_id) for every playlist with bounded concurrency.
+    # Returns {playlist_id: result or the exception that stopped that playlist}.
+    semaphore = asyncio.Semaphore(PLAYLIST_FETCH_CONCURRENCY)
+
+    async def fetch_one(playlist_id):
+        async with semaphore:
+            return await fetch(playlist_id)
+
+    results = await asyncio.gather(*(fetch_one(pid) for pid in playlist_ids), return_exceptions=True)
+    return dict(zip(playlist_ids, results))
+
+def iter_playlist_changes(youtube, playlist_id, playlist, refresh_times, store=None):
+    # Synchronous view of iter_playlist_changes_async for callers outside an event loop.
+    # The fetch runs on a private loop between batches.
+    loop = asyncio.new_event_loop()
+    batches = iter_playlist_changes_async(youtube, playlist_id, playlist, refresh_times, store)
+    try:
+        while True:
+            try:
+                batch = loop.run_until_complete(batches.__anext__())
+            except StopAsyncIteration:
+                return
+            yield batch
+    finally:
+        loop.run_until_complete(batches.aclose())
+        # Let cancelled detail fetches finish unwinding before the loop goes away.
+        tasks = asyncio.all_tasks(loop)
+        if tasks:
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+
+def iter_playlist_items(youtube, playlist_id):
+    # Yields a playlist's video records one page (up to 50 videos) at a time, in playlist
+    # order, for callers such as exporters that want every record without touching the store.
+    for batch in iter_playlist_changes(youtube, playlist_id, {}, {}):
+        yield [batch["videos"][vid] for vid in batch["page"]["video_ids"] if vid in batch["videos"]]
+
+# --- Local Caches ---
+TRANSCRIPT_CACHE_DIR = "transcript_cache"
+TRANSCRIPT_CACHE_MAX_BYTES = 200 * 1024 * 1024 # Least recently used entries are evicted past this size
+TRANSCRIPT_LANGUAGES = ['en', 'en-US']
+LLM_CACHE_DIR = "llm_cache"
+LLM_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+# Content-addressed JSON cache: one gzip file per key (named by the key's SHA-256) and
+# size-bounded LRU eviction, using file mtimes as the recency clock.
+class DiskCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".json.gz")
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path) # Mark as recently used
+        except (OSError, ValueError):
+            self._count(False)
+            return None
+        self._count(True)
+        return value
+
+    def put(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        with atomic_replace(self._path(key), "wb", durable=False) as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            json.dump(value, f)
+        self.evict()
+
+    TEMP_FILE_MAX_AGE = 3600 # Seconds; older .tmp files were left by a killed writer
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            stale_before = time.time() - self.TEMP_FILE_MAX_AGE
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".json.gz"):
+                        entry_stat = entry.stat()
+                        entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+                    elif entry.name.endswith(".tmp") and entry.stat().st_mtime < stale_before:
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats_line(self, label):
+        return f"{label} cache: {self.hits} hits, {self.misses} misses"
+
+transcript_cache = DiskCache(TRANSCRIPT_CACHE_DIR, TRANSCRIPT_CACHE_MAX_BYTES)
+llm_cache = DiskCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES)
+
+def get_video_transcript_segments(video_id):
+    # Returns [{"text", "start", "duration"}, ...], consulting the on-disk cache before YouTube.
+    cache_key = f"transcript:{video_id}:{','.join(TRANSCRIPT_LANGUAGES)}"
+    segments = transcript_cache.get(cache_key)
+    if segments is not None:
+        return segments
+    from youtube_transcript_api import YouTubeTranscriptApi
+    def fetch():
+        with transcript_limiter.slot(requests=1):
+            transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
+            # Try to get an English transcript first
+            transcript = transcript_list.find_transcript(TRANSCRIPT_LANGUAGES)
+            return transcript.fetch()
+
+    try:
+        fetched_data = call_with_retries(f"Transcript fetch for {video_id}", fetch)
     except Exception as e:
         print(f"WARNING: Could not fetch transcript for video {video_id}: {e}", file=sys.stderr)
         return None
+    segments = [{"text": t.text, "start": t.start, "duration": t.duration} for t in fetched_data]
+    transcript_cache.put(cache_key, segments)
+    return segments
 
 # --- Application Logic ---
 def add_playlist(playlist_url):
@@ -144,15 +1293,22 @@ def add_playlist(playlist_url):
         print("Please ensure it's a valid YouTube playlist URL (e.g., https://www.youtube.com/playlist?list=...).", file=sys.stderr)
         return
 
-    data = load_data()
-    if playlist_id in data["playlists"]:
+    store = get_store()
+    if store.get_playlist(playlist_id) is not None:
         print(f"Playlist '{playlist_url}' is already being tracked.", file=sys.stderr)
         return
 
+    new_playlist = {
+        "url": playlist_url,
+        "videos": [],
+        "added_date": datetime.now().isoformat()
+    }
+    from googleapiclient.errors import HttpError
     print(f"Fetching videos from playlist: {playlist_url}...")
     try:
         youtube = get_youtube_service()
-        video_urls = get_playlist_items(youtube, playlist_id)
+        batches = iter_playlist_changes(youtube, playlist_id, new_playlist, store.video_refresh_times(), store)
+        merge_playlist_videos(new_playlist, batches, store.find_video)
     except HttpError as e:
         print(f"ERROR: YouTube API Error: {e.resp.status} - {e.content.decode()}", file=sys.stderr)
         return
@@ -160,22 +1316,63 @@ def add_playlist(playlist_url):
         print(f"ERROR: An unexpected error occurred: {e}", file=sys.stderr)
         return
 
-    if not video_urls:
+    if not new_playlist["videos"]:
+        store.clear_ingest_checkpoint(playlist_id)
         print(f"No videos found in playlist: {playlist_url}. Please check the URL.", file=sys.stderr)
         return
 
-    data["playlists"][playlist_id] = {
-        "url": playlist_url,
-        "videos": video_urls,
-        "added_date": datetime.now().isoformat()
-    }
-    save_data(data)
-    print(f"Successfully added {len(video_urls)} videos from playlist '{playlist_url}'.")
+    store.save_playlist(playlist_id, new_playlist)
+    store.clear_ingest_checkpoint(playlist_id)
+    print(f"Successfully added {len(new_playlist['videos'])} videos from playlist '{playlist_url}'.")
 
-def parse_youtube_datetime(dt_str):
-    return datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
+def merge_playlist_videos(local_playlist, batches, find_video):
+    # Rebuilds the playlist's video list from the page batches of iter_playlist_changes(_async),
+    # consumed as they arrive, keeping the local record (fed flag and analysis) for every
+    # video the store already knows and refreshing its metadata when new details were
+    # fetched. Returns the number of videos that are new to this playlist, or None (leaving
+    # the playlist untouched) when there were no batches because the playlist is unchanged.
+    local_video_urls = {v["url"]: v for v in local_playlist["videos"]}
+
+    new_videos_count = 0
+    updated_videos_list = []
+    playlist_etag = None
+    pages = {}
+
+    for batch in batches:
+        playlist_etag = batch["etag"]
+        pages[batch["page_key"]] = batch["page"]
+        for video_id in batch["page"]["video_ids"]:
+            video_url = normalize_youtube_url(f"https://www.youtube.com/watch?v={video_id}")
+            yt_video = batch["videos"].get(video_id)
+            existing_video = local_video_urls.get(video_url)
+            if existing_video is None:
+                new_videos_count += 1
+                # A video new to this playlist may already be tracked through another one.
+                existing_video = find_video(video_url)
+            if existing_video is not None:
+                if yt_video is not None:
+                    existing_video["publishedAt"] = yt_video["publishedAt"]
+                    existing_video["published_ts"] = yt_video["published_ts"]
+                    existing_video["title"] = yt_video["title"]
+                    existing_video["description"] = yt_video["description"]
+                    existing_video["metadata_refreshed_ts"] = yt_video["metadata_refreshed_ts"]
+                updated_videos_list.append(existing_video)
+            elif yt_video is not None:
+                updated_videos_list.append(yt_video)
+            else:
+                # Private or deleted videos have no details to show.
+                new_videos_count -= 1
+
+    if not pages:
+        return None
+    local_playlist["videos"] = updated_videos_list
+    local_playlist["etag"] = playlist_etag
+    local_playlist["pages"] = pages
+    return new_videos_count
 
 def sync_playlist(playlist_url):
+    # Returns the number of new videos (0 if the playlist is unchanged), or None after
+    # reporting a failure.
     if YOUTUBE_API_KEY == "YOUR_YOUTUBE_API_KEY":
         print("ERROR: Please replace 'YOUR_YOUTUBE_API_KEY' in app.py with your actual API key.", file=sys.stderr)
         return
@@ -183,18 +1380,21 @@ def sync_playlist(playlist_url):
     playlist_id = get_playlist_id(playlist_url)
     if not playlist_id:
         print(f"ERROR: Could not extract playlist ID from URL: {playlist_url}", file=sys.stderr)
-        print("Please ensure it's a valid YouTube playlist URL (e.g., https://www.youtube.com/playlist?list=...).")
+        print("Please ensure it's a valid YouTube playlist URL (e.g., https://www.youtube.com/playlist?list=...).", file=sys.stderr)
         return
 
-    data = load_data()
-    if playlist_id not in data["playlists"]:
+    store = get_store()
+    local_playlist = store.get_playlist(playlist_id)
+    if local_playlist is None:
         print(f"Playlist '{playlist_url}' is not currently tracked. Please add it first.", file=sys.stderr)
         return
 
+    from googleapiclient.errors import HttpError
     print(f"Syncing videos from playlist: {playlist_url}...")
     try:
         youtube = get_youtube_service()
-        current_youtube_videos = get_playlist_items(youtube, playlist_id)
+        batches = iter_playlist_changes(youtube, playlist_id, local_playlist, store.video_refresh_times(), store)
+        new_videos_count = merge_playlist_videos(local_playlist, batches, store.find_video)
     except HttpError as e:
         print(f"ERROR: YouTube API Error during sync: {e.resp.status} - {e.content.decode()}", file=sys.stderr)
         return
@@ -202,137 +1402,268 @@ def sync_playlist(playlist_url):
         print(f"ERROR: An unexpected error occurred during sync: {e}", file=sys.stderr)
         return
 
-    local_playlist = data["playlists"][playlist_id]
-    local_video_urls = {v["url"]: v for v in local_playlist["videos"]}
-
-    new_videos_count = 0
-    updated_videos_list = []
-
-    for yt_video in current_youtube_videos:
-        video_url = yt_video["url"]
-        if video_url in local_video_urls:
-            existing_video = local_video_urls[video_url]
-            existing_video["publishedAt"] = yt_video["publishedAt"]
-            existing_video["title"] = yt_video["title"]
-            existing_video["description"] = yt_video["description"]
-            updated_videos_list.append(existing_video)
-        else:
-            updated_videos_list.append(yt_video)
-            new_videos_count += 1
+    if new_videos_count is None:
+        print(f"Sync complete for '{playlist_url}'. Playlist unchanged since last sync.")
+        return 0
 
-    local_playlist["videos"] = updated_videos_list
-    save_data(data)
+    store.save_playlist(playlist_id, local_playlist)
+    store.clear_ingest_checkpoint(playlist_id)
     print(f"Sync complete for '{playlist_url}'. Added {new_videos_count} new videos.")
+    return new_videos_count
 
-def sync_playlist(playlist_url):
+def sync_all_playlists():
+    # Returns [{"url", "status": "synced" | "unchanged" | "failed", "new_videos", "error"}, ...]
+    # with one entry per playlist, or None after reporting a failure that stopped the whole sync.
     if YOUTUBE_API_KEY == "YOUR_YOUTUBE_API_KEY":
         print("ERROR: Please replace 'YOUR_YOUTUBE_API_KEY' in app.py with your actual API key.", file=sys.stderr)
         return
 
-    playlist_id = get_playlist_id(playlist_url)
-    if not playlist_id:
-        print(f"ERROR: Could not extract playlist ID from URL: {playlist_url}", file=sys.stderr)
-        print("Please ensure it's a valid YouTube playlist URL (e.g., https://www.youtube.com/playlist?list=...).", file=sys.stderr)
-        return
-
-    data = load_data()
-    if playlist_id not in data["playlists"]:
-        print(f"Playlist '{playlist_url}' is not currently tracked. Please add it first.", file=sys.stderr)
-        return
+    store = get_store()
+    data = store.load()
+    if not data["playlists"]:
+        print("No playlists are currently being tracked.")
+        return []
 
-    print(f"Syncing videos from playlist: {playlist_url}...")
+    print(f"Syncing {len(data['playlists'])} playlists...")
     try:
         youtube = get_youtube_service()
-        current_youtube_videos = get_playlist_items(youtube, playlist_id)
-    except HttpError as e:
-        print(f"ERROR: YouTube API Error during sync: {e.resp.status} - {e.content.decode()}", file=sys.stderr)
-        return
+        refresh_times = store.video_refresh_times()
+
+        async def fetch(playlist_id):
+            # Every playlist is saved in one go at the end, so its batches are kept until then.
+            return [batch async for batch in iter_playlist_changes_async(
+                youtube, playlist_id, data["playlists"][playlist_id], refresh_times, store)]
+
+        results = asyncio.run(gather_playlists_async(list(data["playlists"]), fetch))
     except Exception as e:
         print(f"ERROR: An unexpected error occurred during sync: {e}", file=sys.stderr)
         return
 
-    local_playlist = data["playlists"][playlist_id]
-    local_video_urls = {v["url"]: v for v in local_playlist["videos"]}
-
-    new_videos_count = 0
-    updated_videos_list = []
-
-    for yt_video in current_youtube_videos:
-        video_url = yt_video["url"]
-        if video_url in local_video_urls:
-            existing_video = local_video_urls[video_url]
-            existing_video["publishedAt"] = yt_video["publishedAt"]
-            existing_video["title"] = yt_video["title"]
-            existing_video["description"] = yt_video["description"]
-            updated_videos_list.append(existing_video)
+    synced_playlists = {}
+    succeeded = 0
+    summary_lines = []
+    playlist_results = []
+    for playlist_id, result in results.items():
+        local_playlist = data["playlists"][playlist_id]
+        playlist_result = {"url": local_playlist["url"], "status": "failed", "new_videos": 0, "error": None}
+        if is_http_error(result):
+            playlist_result["error"] = f"YouTube API Error: {result.resp.status} - {result.content.decode()}"
+            summary_lines.append(f"  {local_playlist['url']}: FAILED - {playlist_result['error']}")
+        elif isinstance(result, Exception):
+            playlist_result["error"] = str(result)
+            summary_lines.append(f"  {local_playlist['url']}: FAILED - {result}")
+        elif not result:
+            succeeded += 1
+            playlist_result["status"] = "unchanged"
+            summary_lines.append(f"  {local_playlist['url']}: unchanged")
         else:
-            updated_videos_list.append(yt_video)
-            new_videos_count += 1
-
-    local_playlist["videos"] = updated_videos_list
-    save_data(data)
-    print(f"Sync complete for '{playlist_url}'. Added {new_videos_count} new videos.")
+            succeeded += 1
+            new_videos_count = merge_playlist_videos(local_playlist, result, store.find_video)
+            synced_playlists[playlist_id] = local_playlist
+            playlist_result.update(status="synced", new_videos=new_videos_count)
+            summary_lines.append(f"  {local_playlist['url']}: {new_videos_count} new, {len(local_playlist['videos'])} total")
+        playlist_results.append(playlist_result)
+
+    # Everything fetched is merged first and then written in a single save.
+    store.save_playlists(synced_playlists)
+    for playlist_id in synced_playlists:
+        store.clear_ingest_checkpoint(playlist_id)
+    print(f"Sync complete for {succeeded} of {len(results)} playlists:")
+    for line in summary_lines:
+        print(line)
+    return playlist_results
 
 def analyze_video(video_url, summary, usefulness_rating, actionable_points_str):
     video_url = normalize_youtube_url(video_url) # Normalize input URL
-    data = load_data()
-    found_video = False
-    for playlist_id, playlist_info in data["playlists"].items():
-        for video in playlist_info["videos"]:
-            if video["url"] == video_url:
-                video["summary"] = summary
-                video["usefulness_rating"] = usefulness_rating
-                video["actionable_points"] = [ap.strip() for ap in actionable_points_str.split(';') if ap.strip()]
-                found_video = True
-                break
-        if found_video:
-            break
-
-    if found_video:
-        save_data(data)
+    store = get_store()
+    video = store.find_video(video_url)
+    if video:
+        video["summary"] = summary
+        video["usefulness_rating"] = usefulness_rating
+        video["actionable_points"] = [ap.strip() for ap in actionable_points_str.split(';') if ap.strip()]
+        store.update_video(video)
         print(f"Analysis for {video_url} saved successfully.")
     else:
         print(f"Error: Video {video_url} not found in any tracked playlist.", file=sys.stderr)
 
-def auto_analyze_video_with_llm(video_url):
-    video_url = normalize_youtube_url(video_url) # Normalize input URL
-    if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY":
-        print("ERROR: Please replace 'YOUR_GEMINI_API_KEY' in app.py with your actual Gemini API key.", file=sys.stderr)
-        return
-
-    data = load_data()
-    video_data = None
-    for playlist_id, playlist_info in data["playlists"].items():
-        for video in playlist_info["videos"]:
-            if video["url"] == video_url:
-                video_data = video
-                break
-        if video_data:
+LLM_MODEL_NAME = 'models/gemini-2.5-flash'
+PROMPT_VERSION = 1 # Bump when a prompt template changes so cached responses are not reused
+ANALYZE_WORKERS = 4 # Max videos analyzed concurrently by auto_analyze_all
+BATCH_TOKEN_BUDGET = 6000 # Max estimated content tokens packed into one batched prompt
+BATCH_MAX_VIDEO_TOKENS = 1500 # Videos longer than this are always analyzed on their own
+BATCH_MAX_VIDEOS = 10
+LONG_TRANSCRIPT_TOKENS = 12000 # Transcripts longer than this are summarized chunk by chunk first
+CHUNK_TOKENS = 4000 # Target size of each transcript chunk
+CHUNK_WORKERS = 4 # Chunks of one transcript summarized concurrently
+TRANSCRIPT_MAX_TOKENS = 30000 # Per-video cap on transcript tokens, applied before chunking
+TRANSCRIPT_TRUNCATION_POLICY = "chapters" # "head_tail", "sampled", "chapters" or "none"
+SAMPLED_WINDOWS = 8 # Evenly spaced excerpts kept by the "sampled" policy
+
+class LLMResponseError(ValueError):
+    def __init__(self, error, llm_output):
+        super().__init__(f"{error}\nLLM Output: {llm_output}")
+        self.llm_output = llm_output
+
+_llm_model = None
+_llm_model_lock = threading.Lock()
+
+def get_llm_model():
+    global _llm_model
+    with _llm_model_lock:
+        if _llm_model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
+            _llm_model = genai.GenerativeModel(LLM_MODEL_NAME)
+        return _llm_model
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_CHAPTER_PATTERN = re.compile(r"(?:(\d{1,2}):)?(\d{1,2}):(\d{2})\s+(.+?)(?=\s+(?:\d{1,2}:)?\d{1,2}:\d{2}\s|$)")
+
+def estimate_tokens(text):
+    # Words and punctuation count as one token each, with long words split every ~6 characters,
+    # which tracks subword tokenizers closely enough for budgeting English text.
+    return sum(1 + (len(piece) - 1) // 6 for piece in _TOKEN_PATTERN.findall(text))
+
+# Tokens actually sent to the model vs. avoided (by truncation or cache hits) during this run.
+class TokenStats:
+    def __init__(self):
+        self.sent = 0
+        self.saved = 0
+        self._lock = threading.Lock()
+
+    def record(self, sent=0, saved=0):
+        with self._lock:
+            self.sent += sent
+            self.saved += saved
+
+    def reset(self):
+        with self._lock:
+            self.sent = 0
+            self.saved = 0
+
+    def stats_line(self):
+        total = self.sent + self.saved
+        percent = 100 * self.saved / total if total else 0
+        return f"Tokens: {self.sent} sent, {self.saved} saved ({percent:.0f}%)"
+
+token_stats = TokenStats()
+
+def parse_chapters(description):
+    # Finds "0:00 Intro 4:12 Next topic ..." style chapter lists; YouTube requires the first at 0:00.
+    chapters = []
+    for hours, minutes, seconds, title in _CHAPTER_PATTERN.findall(description or ""):
+        start = int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+        chapters.append((start, title.strip()))
+    if len(chapters) < 2 or chapters[0][0] != 0:
+        return []
+    return chapters
+
+def take_segments(segments, budget, from_end=False):
+    # Longest run of whole segments from the start (or end) that fits in budget tokens.
+    taken, used = [], 0
+    for segment in (reversed(segments) if from_end else segments):
+        tokens = estimate_tokens(segment["text"])
+        if used + tokens > budget:
             break
-
-    if not video_data:
-        print(f"Error: Video {video_url} not found in any tracked playlist. Please add it first.", file=sys.stderr)
-        return
-
-    print(f"Auto-analyzing video: {video_data.get('title', video_url)}...")
-
-    # Extract video_id from the normalized URL
-    parsed_normalized_url = urlparse(video_url)
-    video_id = parse_qs(parsed_normalized_url.query).get('v', [None])[0]
-
-    if not video_id:
-        print(f"ERROR: Could not extract video ID from normalized URL: {video_url}", file=sys.stderr)
-        return
-
-    transcript = get_video_transcript(video_id)
-
+        taken.append(segment)
+        used += tokens
+    return taken[::-1] if from_end else taken
+
+def truncate_transcript(segments, description, policy=None, max_tokens=None):
+    # Caps a transcript at max_tokens according to policy, inserting "[...]" marker segments
+    # where text was dropped. Returns the (possibly unchanged) segment list.
+    policy = policy or TRANSCRIPT_TRUNCATION_POLICY
+    max_tokens = max_tokens or TRANSCRIPT_MAX_TOKENS
+    total_tokens = sum(estimate_tokens(s["text"]) for s in segments)
+    if policy == "none" or total_tokens <= max_tokens:
+        return segments
+
+    gap = {"text": "[...]", "start": None, "duration": 0}
+    gap_tokens = estimate_tokens(gap["text"])
+    chapters = parse_chapters(description) if policy == "chapters" else []
+    if chapters:
+        kept = []
+        # Chapter headings and gap markers come out of the budget too.
+        overhead = sum(estimate_tokens(f"[Chapter: {title}]") + gap_tokens for _, title in chapters)
+        budget = max(max_tokens - overhead, 0) // len(chapters)
+        for i, (start, title) in enumerate(chapters):
+            end = chapters[i + 1][0] if i + 1 < len(chapters) else float("inf")
+            chapter_segments = [s for s in segments if start <= s["start"] < end]
+            excerpt = take_segments(chapter_segments, budget)
+            kept.append({"text": f"[Chapter: {title}]", "start": start, "duration": 0})
+            kept.extend(excerpt)
+            if len(excerpt) < len(chapter_segments):
+                kept.append(gap)
+    elif policy == "sampled":
+        kept = []
+        window_size = len(segments) / SAMPLED_WINDOWS
+        budget = max(max_tokens - SAMPLED_WINDOWS * gap_tokens, 0) // SAMPLED_WINDOWS
+        for i in range(SAMPLED_WINDOWS):
+            window = segments[int(i * window_size):int((i + 1) * window_size)]
+            kept.extend(take_segments(window, budget))
+            kept.append(gap)
+    else: # "head_tail", and "chapters" when the description has none
+        budget = max(max_tokens - gap_tokens, 0) // 2
+        kept = take_segments(segments, budget) + [gap] + take_segments(segments, budget, from_end=True)
+
+    kept_tokens = sum(estimate_tokens(s["text"]) for s in kept)
+    token_stats.record(saved=max(total_tokens - kept_tokens, 0))
+    return kept
+
+def build_llm_content(video_data, transcript):
     if not transcript:
-        print(f"WARNING: No transcript available for {video_url}. Analyzing based on title/description only.", file=sys.stderr)
-        content_for_llm = f"Title: {video_data.get('title', '')}\nDescription: {video_data.get('description', '')}"
-    else:
-        content_for_llm = f"Title: {video_data.get('title', '')}\nDescription: {video_data.get('description', '')}\nTranscript: {transcript}"
+        return f"Title: {video_data.get('title', '')}\nDescription: {video_data.get('description', '')}"
+    return f"Title: {video_data.get('title', '')}\nDescription: {video_data.get('description', '')}\nTranscript: {transcript}"
+
+def chunk_transcript(segments, chunk_tokens):
+    # Groups consecutive transcript segments into chunks of roughly chunk_tokens each.
+    chunks = []
+    current, current_tokens = [], 0
+    for segment in segments:
+        tokens = estimate_tokens(segment["text"])
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(segment["text"])
+        current_tokens += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def build_chunk_prompt(video_data, chunk, part, total_parts):
+    return f"""Summarize the following section (part {part} of {total_parts}) of a YouTube video transcript. Provide the output in JSON format with a concise "summary" of the section and a list of "key_points" holding concrete, actionable takeaways. If there are none, return an empty array.
+
+Video title: {video_data.get('title', '')}
+Transcript section:
+{chunk}
+
+JSON Output Example:
+{{
+  "summary": "A concise summary of this section.",
+  "key_points": [
+    "Point 1"
+  ]
+}}
+"""
 
-    prompt = f"""Analyze the following YouTube video content and provide a summary, a usefulness rating, and actionable points. The usefulness rating should be one of: 'highly_useful', 'useful', 'fluff', 'outdated', 'review_needed'. Provide the output in JSON format. If no actionable points, return an empty array.
+def summarize_transcript_chunks(model, video_data, segments, refresh=False):
+    # Map step: summarize every chunk in parallel. The section summaries then stand in for the
+    # transcript in the regular analysis prompt, which acts as the reduce step.
+    chunks = chunk_transcript(segments, CHUNK_TOKENS)
+    prompts = [build_chunk_prompt(video_data, chunk, i + 1, len(chunks)) for i, chunk in enumerate(chunks)]
+    with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as executor:
+        chunk_summaries = list(executor.map(lambda p: generate_llm_json(model, p, refresh), prompts))
+
+    lines = [f"(Summarized in {len(chunks)} sections)"]
+    for i, chunk_summary in enumerate(chunk_summaries):
+        line = f"Section {i + 1}: {chunk_summary.get('summary', '')}"
+        if chunk_summary.get("key_points"):
+            line += " Key points: " + "; ".join(chunk_summary["key_points"])
+        lines.append(line)
+    return "\n".join(lines)
+
+def build_analysis_prompt(content_for_llm):
+    return f"""Analyze the following YouTube video content and provide a summary, a usefulness rating, and actionable points. The usefulness rating should be one of: 'highly_useful', 'useful', 'fluff', 'outdated', 'review_needed'. Provide the output in JSON format. If no actionable points, return an empty array.
 
 Content:
 {content_for_llm}
@@ -348,210 +1679,958 @@ JSON Output Example:
 }}
 """
 
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel('models/gemini-2.5-flash')
-        response = model.generate_content(prompt)
-        llm_output = response.text
-        # Strip markdown code block fences if present
-        if llm_output.startswith('```json') and llm_output.endswith('```'):
-            llm_output = llm_output[len('```json'):-len('```')].strip()
-
-        # Attempt to parse JSON output from LLM
-        llm_analysis = json.loads(llm_output)
+def build_batch_prompt(batch):
+    # batch is a list of (video_id, content_for_llm) pairs.
+    videos_block = "\n\n".join(f"Video ID: {video_id}\nContent:\n{content}" for video_id, content in batch)
+    return f"""Analyze each of the following YouTube videos and provide a summary, a usefulness rating, and actionable points for each one. The usefulness rating should be one of: 'highly_useful', 'useful', 'fluff', 'outdated', 'review_needed'. Provide the output as a JSON array with exactly one object per video, each including that video's "video_id". If a video has no actionable points, return an empty array for it.
 
-        # Update video data with LLM analysis
-        video_data["summary"] = llm_analysis.get("summary", "")
-        video_data["usefulness_rating"] = llm_analysis.get("usefulness_rating", "unknown")
-        video_data["actionable_points"] = llm_analysis.get("actionable_points", [])
+{videos_block}
 
-        save_data(data)
-        print(f"Successfully auto-analyzed {video_url}.")
+JSON Output Example:
+[
+  {{
+    "video_id": "abc123",
+    "summary": "A concise summary of the video.",
+    "usefulness_rating": "useful",
+    "actionable_points": [
+      "Point 1",
+      "Point 2"
+    ]
+  }}
+]
+"""
 
+def generate_llm_json(model, prompt, refresh=False, cacheable=None):
+    # Sends the prompt and parses the JSON reply. Replies are cached on disk keyed by
+    # (model, prompt version, prompt); refresh=True skips the lookup but still stores the result.
+    # cacheable(result) -> bool keeps malformed replies out of the cache (and ignores any
+    # that are already in it), so they are retried next run instead of replayed forever.
+    cache_key = json.dumps([LLM_MODEL_NAME, PROMPT_VERSION, prompt])
+    if not refresh:
+        cached = llm_cache.get(cache_key)
+        if cached is not None and (cacheable is None or cacheable(cached)):
+            token_stats.record(saved=estimate_tokens(prompt))
+            return cached
+
+    prompt_tokens = estimate_tokens(prompt)
+    token_stats.record(sent=prompt_tokens)
+    def generate():
+        with gemini_limiter.slot(requests=1, tokens=prompt_tokens):
+            return model.generate_content(prompt)
+
+    response = call_with_retries("Gemini request", generate)
+    llm_output = response.text
+    # Strip markdown code block fences if present
+    if llm_output.startswith('```json') and llm_output.endswith('```'):
+        llm_output = llm_output[len('```json'):-len('```')].strip()
+
+    # Attempt to parse JSON output from LLM
+    try:
+        result = json.loads(llm_output)
     except json.JSONDecodeError as e:
-        print(f"ERROR: Failed to parse LLM JSON response for {video_url}: {e}\nLLM Output: {llm_output}", file=sys.stderr)
+        raise LLMResponseError(e, llm_output) from e
+    if cacheable is None or cacheable(result):
+        llm_cache.put(cache_key, result)
+    return result
+
+def get_llm_content(model, video_url, video_data, refresh=False):
+    # Fetches the transcript and builds the content block, condensing long transcripts with
+    # summarize_transcript_chunks. Returns None after reporting a failure.
+    video_id = get_video_id(video_url)
+    if not video_id:
+        print(f"ERROR: Could not extract video ID from normalized URL: {video_url}", file=sys.stderr)
+        return None
+
+    segments = get_video_transcript_segments(video_id)
+    if not segments:
+        print(f"WARNING: No transcript available for {video_url}. Analyzing based on title/description only.", file=sys.stderr)
+        return build_llm_content(video_data, None)
+
+    segments = truncate_transcript(segments, video_data.get("description", ""))
+    transcript = " ".join([s["text"] for s in segments])
+    if estimate_tokens(transcript) > LONG_TRANSCRIPT_TOKENS:
+        try:
+            transcript = summarize_transcript_chunks(model, video_data, segments, refresh)
+        except Exception as e:
+            print(f"ERROR: Failed to summarize long transcript for {video_url}: {e}", file=sys.stderr)
+            return None
+    return build_llm_content(video_data, transcript)
+
+def run_llm_analysis(model, video_url, video_data, refresh=False):
+    # Fetches the transcript and asks the model for an analysis. Returns the parsed
+    # analysis dict, or None after reporting the failure.
+    content_for_llm = get_llm_content(model, video_url, video_data, refresh)
+    if content_for_llm is None:
+        return None
+    return analyze_llm_content(model, video_url, content_for_llm, refresh)
+
+def analyze_llm_content(model, video_url, content_for_llm, refresh=False):
+    prompt = build_analysis_prompt(content_for_llm)
+    try:
+        return generate_llm_json(model, prompt, refresh)
+    except LLMResponseError as e:
+        print(f"ERROR: Failed to parse LLM JSON response for {video_url}: {e}", file=sys.stderr)
     except Exception as e:
         print(f"ERROR: Failed to auto-analyze {video_url}: {e}", file=sys.stderr)
+    return None
 
-def mark_video_watched(video_url):
+def analyze_batch(model, batch, urls, refresh=False):
+    # Sends several short videos in one request. Any video missing from the reply (or every
+    # video, if the reply can't be parsed as the expected array) falls back to its own request.
+    results = {}
+    batch_ids = {video_id for video_id, content_for_llm in batch}
+
+    def covers_batch(reply):
+        return isinstance(reply, list) and {a.get("video_id") for a in reply if isinstance(a, dict)} >= batch_ids
+
+    try:
+        llm_analyses = generate_llm_json(model, build_batch_prompt(batch), refresh, cacheable=covers_batch)
+        if not isinstance(llm_analyses, list):
+            raise LLMResponseError("expected a JSON array", json.dumps(llm_analyses))
+        for llm_analysis in llm_analyses:
+            if isinstance(llm_analysis, dict) and llm_analysis.get("video_id") in urls:
+                results[llm_analysis["video_id"]] = llm_analysis
+    except Exception as e:
+        print(f"WARNING: Batched analysis of {len(batch)} videos failed, retrying individually: {e}", file=sys.stderr)
+
+    for video_id, content_for_llm in batch:
+        if video_id not in results:
+            llm_analysis = analyze_llm_content(model, urls[video_id], content_for_llm, refresh)
+            if llm_analysis is not None:
+                results[video_id] = llm_analysis
+    return results
+
+def analyze_videos_batched(model, videos, refresh=False):
+    # Returns {video_id: analysis} for the videos that could be analyzed.
+    urls = {get_video_id(v["url"]): v["url"] for v in videos}
+    with ThreadPoolExecutor(max_workers=ANALYZE_WORKERS) as executor:
+        contents = list(executor.map(lambda v: get_llm_content(model, v["url"], v, refresh), videos))
+
+    # Greedily pack short videos into batches under the token budget; long ones go alone.
+    batches = []
+    current, current_tokens = [], 0
+    for video, content_for_llm in zip(videos, contents):
+        if content_for_llm is None:
+            continue
+        item = (get_video_id(video["url"]), content_for_llm)
+        tokens = estimate_tokens(content_for_llm)
+        if tokens > BATCH_MAX_VIDEO_TOKENS:
+            batches.append([item])
+            continue
+        if current and (current_tokens + tokens > BATCH_TOKEN_BUDGET or len(current) >= BATCH_MAX_VIDEOS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+
+    def run(batch):
+        if len(batch) == 1:
+            video_id, content_for_llm = batch[0]
+            llm_analysis = analyze_llm_content(model, urls[video_id], content_for_llm, refresh)
+            return {video_id: llm_analysis} if llm_analysis is not None else {}
+        return analyze_batch(model, batch, urls, refresh)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=ANALYZE_WORKERS) as executor:
+        for batch_results in executor.map(run, batches):
+            results.update(batch_results)
+    print(f"Packed {sum(len(b) for b in batches)} videos into {len(batches)} prompts; {len(results)} analyzed.")
+    return results
+
+def apply_llm_analysis(video_data, llm_analysis):
+    video_data["summary"] = llm_analysis.get("summary", "")
+    video_data["usefulness_rating"] = llm_analysis.get("usefulness_rating", "unknown")
+    video_data["actionable_points"] = llm_analysis.get("actionable_points", [])
+
+def auto_analyze_video_with_llm(video_url, refresh=False):
+    # Returns the analyzed video record, or None after reporting a failure.
     video_url = normalize_youtube_url(video_url) # Normalize input URL
-    data = load_data()
-    found_video = False
-    for playlist_id, playlist_info in data["playlists"].items():
-        for video in playlist_info["videos"]:
-            if video["url"] == video_url:
-                video["fed"] = True
-                found_video = True
-                break
-        if found_video:
-            break
+    if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY":
+        print("ERROR: Please replace 'YOUR_GEMINI_API_KEY' in app.py with your actual Gemini API key.", file=sys.stderr)
+        return
+
+    store = get_store()
+    video_data = store.find_video(video_url)
+    if not video_data:
+        print(f"Error: Video {video_url} not found in any tracked playlist. Please add it first.", file=sys.stderr)
+        return
+
+    print(f"Auto-analyzing video: {video_data.get('title', video_url)}...")
+
+    llm_analysis = run_llm_analysis(get_llm_model(), video_url, video_data, refresh)
+    if llm_analysis is None:
+        return
+
+    apply_llm_analysis(video_data, llm_analysis)
+    store.update_video(video_data)
+    print(f"Successfully auto-analyzed {video_url}.")
+    print(transcript_cache.stats_line("Transcript"))
+    print(llm_cache.stats_line("LLM response"))
+    print(token_stats.stats_line())
+    return video_data
+
+def auto_analyze_all(playlist_url=None, only_unknown=False, refresh=False, batch=False):
+    # Returns (videos analyzed, videos attempted), or None after reporting a failure.
+    if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY":
+        print("ERROR: Please replace 'YOUR_GEMINI_API_KEY' in app.py with your actual Gemini API key.", file=sys.stderr)
+        return
+
+    store = get_store()
+    if playlist_url:
+        playlist_id = get_playlist_id(playlist_url)
+        playlist = store.get_playlist(playlist_id) if playlist_id else None
+        if playlist is None:
+            print(f"Playlist '{playlist_url}' is not currently tracked. Please add it first.", file=sys.stderr)
+            return
+        videos = playlist["videos"]
+    else:
+        store.load()
+        videos = list(store.index.values())
+
+    if only_unknown:
+        videos = [v for v in videos if v.get("usefulness_rating", "unknown") == "unknown"]
+    if not videos:
+        print("No videos to analyze.")
+        return 0, 0
+
+    print(f"Auto-analyzing {len(videos)} videos with up to {ANALYZE_WORKERS} in parallel...")
+    analyzed_videos = analyze_videos(videos, refresh, batch)
+    print(f"Auto-analysis complete. Analyzed {len(analyzed_videos)} of {len(videos)} videos.")
+    print(transcript_cache.stats_line("Transcript"))
+    print(llm_cache.stats_line("LLM response"))
+    print(token_stats.stats_line())
+    return len(analyzed_videos), len(videos)
+
+def analyze_videos(videos, refresh=False, batch=False):
+    # Runs the LLM over videos and stores the results; returns the videos that were analyzed.
+    model = get_llm_model()
+    analyzed_videos = []
+    if batch:
+        results = analyze_videos_batched(model, videos, refresh)
+        for video_data in videos:
+            llm_analysis = results.get(get_video_id(video_data["url"]))
+            if llm_analysis is not None:
+                apply_llm_analysis(video_data, llm_analysis)
+                analyzed_videos.append(video_data)
+    else:
+        with ThreadPoolExecutor(max_workers=ANALYZE_WORKERS) as executor:
+            futures = {executor.submit(run_llm_analysis, model, v["url"], v, refresh): v for v in videos}
+            for future in as_completed(futures):
+                video_data = futures[future]
+                llm_analysis = future.result()
+                if llm_analysis is not None:
+                    apply_llm_analysis(video_data, llm_analysis)
+                    analyzed_videos.append(video_data)
+                    print(f"Analyzed: {video_data.get('title', video_data['url'])}")
+
+    # All results are committed together once the pool has drained.
+    get_store().update_videos(analyzed_videos)
+    return analyzed_videos
+
+def set_video_fed(video_url):
+    # Shared by watch and skip; returns the updated record, or None if the video is unknown.
+    store = get_store()
+    video = store.find_video(normalize_youtube_url(video_url))
+    if video:
+        video["fed"] = True
+        store.update_video(video)
+    return video
 
-    if found_video:
-        save_data(data)
+def mark_video_watched(video_url):
+    video_url = normalize_youtube_url(video_url) # Normalize input URL
+    if set_video_fed(video_url):
         print(f"Video {video_url} marked as watched.")
     else:
         print(f"Error: Video {video_url} not found in any tracked playlist.", file=sys.stderr)
 
 def skip_video(video_url):
     video_url = normalize_youtube_url(video_url) # Normalize input URL
-    data = load_data()
-    found_video = False
-    for playlist_id, playlist_info in data["playlists"].items():
-        for video in playlist_info["videos"]:
-            if video["url"] == video_url:
-                video["fed"] = True
-                found_video = True
-                break
-        if found_video:
-            break
-
-    if found_video:
-        save_data(data)
+    if set_video_fed(video_url):
         print(f"Video {video_url} skipped for today.")
     else:
         print(f"Error: Video {video_url} not found in any tracked playlist.", file=sys.stderr)
 
 def list_playlists():
-    data = load_data()
-    if not data["playlists"]:
+    summaries = list(get_store().playlist_summaries())
+    if not summaries:
         print("No playlists are currently being tracked.")
         return
 
     print("--- Tracked Playlists ---")
-    for playlist_id, playlist_info in data["playlists"].items():
-        total_videos = len(playlist_info["videos"])
-        fed_videos = sum(1 for v in playlist_info["videos"] if v["fed"])
+    for url, added_date, total_videos, fed_videos in summaries:
         unfed_videos = total_videos - fed_videos
-        print(f"URL: {playlist_info['url']}")
+        print(f"URL: {url}")
         print(f"  Videos: {total_videos} (Fed: {fed_videos}, Unfed: {unfed_videos})")
-        print(f"  Added: {datetime.fromisoformat(playlist_info['added_date']).strftime('%Y-%m-%d')}")
+        print(f"  Added: {datetime.fromisoformat(added_date).strftime('%Y-%m-%d')}")
         print("-" * 25)
 
-def get_next_video():
-    data = load_data()
+def feed_next_videos():
+    # Hands out today's videos as [(video, playlist_url), ...] and marks them fed. Returns None
+    # when today's videos were already handed out.
+    store = get_store()
     today = datetime.now().date()
 
-    if data["last_fed_date"]:
-        last_fed = datetime.fromisoformat(data["last_fed_date"]).date()
+    last_fed_date = store.get_meta("last_fed_date")
+    if last_fed_date:
+        last_fed = datetime.fromisoformat(last_fed_date).date()
         if last_fed == today:
-            print(f"You've already been fed {DAILY_VIDEO_LIMIT} video(s) today. Come back tomorrow!")
-            return
+            return None
 
-    all_unfed_videos = []
-    for playlist_id, playlist_info in data["playlists"].items():
-        for video in playlist_info["videos"]:
-            if not video["fed"]:
-                all_unfed_videos.append(video)
+    # The store keeps unfed videos in feed order, so this reads the top entries only.
+    videos_to_feed = store.next_feed_videos(DAILY_VIDEO_LIMIT)
+    if not videos_to_feed:
+        return []
 
-    if not all_unfed_videos:
+    for video, playlist_url in videos_to_feed:
+        video["fed"] = True
+    # One write for the whole day's feed, date included.
+    store.update_videos([video for video, playlist_url in videos_to_feed], meta={"last_fed_date": today.isoformat()})
+    return videos_to_feed
+
+def get_next_video():
+    videos_to_feed = feed_next_videos()
+    if videos_to_feed is None:
+        print(f"You've already been fed {DAILY_VIDEO_LIMIT} video(s) today. Come back tomorrow!")
+        return
+
+    if not videos_to_feed:
         print("No new unfed videos available across all tracked playlists. Add more playlists or sync existing ones!")
         return
 
-    # Sort unfed videos by usefulness (highest priority first) then by publishedAt (newest first)
-    all_unfed_videos.sort(key=lambda x: (
-        USEFULNESS_ORDER.get(x.get("usefulness_rating", "unknown"), len(USEFULNESS_ORDER)), # Ascending for usefulness
-        -parse_youtube_datetime(x["publishedAt"]).timestamp() # Descending for publishedAt (by negating timestamp)
-    ))
+    for video, playlist_url in videos_to_feed:
+        print(f"Here's your next mindful video from {playlist_url}:")
+        print(f"Title: {video.get('title', 'N/A')}")
+        print(f"URL: {video['url']}")
+        if "summary" in video:
+            print(f"Summary: {video['summary']}")
+        if "usefulness_rating" in video:
+            print(f"Usefulness: {video['usefulness_rating']}")
+        if "actionable_points" in video and video["actionable_points"]:
+            print("Actionable Points:")
+            for ap in video["actionable_points"]:
+                print(f"  - {ap}")
+        print("\n") # Add a newline for better readability
+
+# --- Daemon ---
+
+SOCKET_FILE = "mindfultube.sock"
+
+_command_lock = threading.Lock()
+
+@contextmanager
+def command_session(stdout, stderr, shared=False):
+    # Runs one command at a time with its output captured. redirect_stdout swaps the
+    # process-wide sys.stdout, which is one more reason commands never overlap.
+    with _command_lock, redirect_stdout(stdout), redirect_stderr(stderr):
+        token_stats.reset()
+        transcript_cache.reset_stats()
+        llm_cache.reset_stats()
+        with data_lock(shared=shared):
+            get_store().reload_if_changed()
+            yield
+
+def warm_up():
+    # Loads everything a command would otherwise build from scratch. Opening the store can
+    # create or migrate the database, so it takes the lock like any other command.
+    with data_lock():
+        get_store().load()
+    try:
+        if YOUTUBE_API_KEY != "YOUR_YOUTUBE_API_KEY":
+            get_youtube_service()
+        if GEMINI_API_KEY != "YOUR_GEMINI_API_KEY":
+            get_llm_model()
+    except Exception as e:
+        print(f"WARNING: Could not prepare API clients, will retry per command: {e}", file=sys.stderr)
+
+def _interrupt_on_sigterm(signum, frame):
+    # Treat SIGTERM (kill, systemd stop) like Ctrl-C so servers shut down cleanly either way.
+    raise KeyboardInterrupt
+
+class _SocketStream:
+    # File-like stand-in for stdout/stderr that forwards each write to the client as a
+    # {"stdout": text} or {"stderr": text} line.
+    def __init__(self, wfile, name, write_lock):
+        self.wfile = wfile
+        self.name = name
+        self.write_lock = write_lock
+        self.disconnected = False
+
+    def write(self, text):
+        if text and not self.disconnected:
+            with self.write_lock:
+                try:
+                    self.wfile.write((json.dumps({self.name: text}) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                except OSError:
+                    # The client went away; finish the command anyway rather than leave the
+                    # store half-updated.
+                    self.disconnected = True
+        return len(text)
+
+    def flush(self):
+        pass
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    # One connection carries one command: {"argv": [command, args...]} in, output lines
+    # out, then {"done": true}.
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return # A liveness probe from daemon_is_running()
+        try:
+            argv = json.loads(line)["argv"]
+        except (ValueError, KeyError, TypeError):
+            self.wfile.write(b'{"stderr": "Malformed request\\n"}\n{"done": true}\n')
+            return
+        write_lock = threading.Lock()
+        stdout = _SocketStream(self.wfile, "stdout", write_lock)
+        stderr = _SocketStream(self.wfile, "stderr", write_lock)
+        with command_session(stdout, stderr, shared=argv[:1] == ["list"]):
+            try:
+                if not argv:
+                    print_usage()
+                else:
+                    run_command(["app.py"] + argv)
+            except Exception:
+                traceback.print_exc()
+        if not stdout.disconnected:
+            try:
+                self.wfile.write(b'{"done": true}\n')
+            except OSError:
+                pass
+
+def daemon_is_running():
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(SOCKET_FILE):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(SOCKET_FILE)
+        except OSError:
+            return False
+    return True
+
+def serve(scheduler=None):
+    if not hasattr(socket, "AF_UNIX"):
+        print("ERROR: serve needs Unix domain sockets, which this platform does not support.", file=sys.stderr)
+        return
+    if os.path.exists(SOCKET_FILE):
+        if daemon_is_running():
+            print(f"A MindfulTube daemon is already listening on {SOCKET_FILE}.", file=sys.stderr)
+            return
+        os.unlink(SOCKET_FILE) # Left behind by a daemon that did not shut down cleanly
+
+    warm_up()
+    signal.signal(signal.SIGTERM, _interrupt_on_sigterm)
+    with socketserver.ThreadingUnixStreamServer(SOCKET_FILE, CommandHandler) as server:
+        server.daemon_threads = True
+        print(f"MindfulTube daemon listening on {SOCKET_FILE}. Press Ctrl-C to stop.", flush=True)
+        if scheduler:
+            scheduler.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nShutting down.")
+        finally:
+            os.unlink(SOCKET_FILE)
+
+def run_via_daemon(argv):
+    # Sends the command to a running daemon and relays its output. Returns False when no
+    # daemon is listening, so the caller can run the command in this process instead.
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(SOCKET_FILE):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_FILE)
+    except OSError:
+        sock.close()
+        return False
+    with sock, sock.makefile("rwb") as f:
+        f.write((json.dumps({"argv": argv}) + "\n").encode("utf-8"))
+        f.flush()
+        for line in f:
+            message = json.loads(line)
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+                sys.stdout.flush()
+            elif "stderr" in message:
+                sys.stderr.write(message["stderr"])
+                sys.stderr.flush()
+            elif message.get("done"):
+                return True
+    # Don't fall back here: the daemon may already have applied part of the command.
+    print("ERROR: The MindfulTube daemon closed the connection before the command finished.", file=sys.stderr)
+    return True
+
+# --- Scheduler ---
+
+SCHEDULE_INTERVAL_MINUTES = 60 # How often the scheduler syncs every tracked playlist
+SCHEDULE_ANALYZE_PER_RUN = 5 # Queued videos analyzed per run, spreading Gemini usage across runs
+ANALYSIS_QUEUE_KEY = "analysis_queue" # Meta key holding the JSON list of video IDs awaiting analysis
+
+def load_analysis_queue(store):
+    return json.loads(store.get_meta(ANALYSIS_QUEUE_KEY) or "[]")
+
+def save_analysis_queue(store, queue):
+    store.set_meta(ANALYSIS_QUEUE_KEY, json.dumps(queue))
+
+def log_scheduler(message):
+    # Goes to the real stdout even while a daemon command has it redirected.
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", file=sys.__stdout__, flush=True)
+
+class Scheduler:
+    # Each run syncs every playlist, queues every video that is still unrated, and analyzes at
+    # most analyze_per_run of them; the rest wait for later runs. The queue lives in the
+    # store, so it survives restarts.
+    def __init__(self, interval_minutes=SCHEDULE_INTERVAL_MINUTES, analyze_per_run=SCHEDULE_ANALYZE_PER_RUN):
+        self.interval = interval_minutes * 60
+        self.analyze_per_run = analyze_per_run
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run_once(self):
+        # A run requested while another is still going (a long sync, or a manual trigger
+        # during a timed run) is dropped rather than stacked behind it.
+        if not self._run_lock.acquire(blocking=False):
+            log_scheduler("Previous run still in progress; skipping this one.")
+            return False
+        try:
+            log_scheduler("Scheduled run started.")
+            self._sync()
+            self._analyze()
+            log_scheduler("Scheduled run finished.")
+        except Exception as e:
+            log_scheduler(f"Scheduled run failed: {e}")
+        finally:
+            self._run_lock.release()
+        return True
+
+    def _sync(self):
+        # Sync and analysis take the command lock separately, so interactive commands can
+        # get in between them.
+        with command_session(sys.__stdout__, sys.__stderr__):
+            sync_all_playlists()
+            # Every unrated video is queued, not only the ones this sync found, so videos from
+            # add or a manual sync, or tracked before the scheduler ran, get analyzed too.
+            store = get_store()
+            store.load()
+            queue = load_analysis_queue(store)
+            queued_ids = set(queue)
+            unrated_ids = [video_id for video_id, video in store.index.items()
+                           if video.get("usefulness_rating", "unknown") == "unknown" and video_id not in queued_ids]
+            if unrated_ids:
+                queue.extend(unrated_ids)
+                save_analysis_queue(store, queue)
+                log_scheduler(f"Queued {len(unrated_ids)} unrated videos for analysis ({len(queue)} waiting).")
+
+    def _analyze(self):
+        with command_session(sys.__stdout__, sys.__stderr__):
+            store = get_store()
+            queue = load_analysis_queue(store)
+            if not queue:
+                return
+            if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY":
+                log_scheduler(f"No Gemini API key configured; {len(queue)} videos stay queued.")
+                return
+
+            batch, rest = queue[:self.analyze_per_run], queue[self.analyze_per_run:]
+            videos = []
+            for video_id in batch:
+                video = store.find_video(f"https://www.youtube.com/watch?v={video_id}")
+                # Videos analyzed by hand in the meantime, or dropped with their playlist, are skipped.
+                if video and video.get("usefulness_rating", "unknown") == "unknown":
+                    videos.append(video)
+            analyzed_ids = {get_video_id(v["url"]) for v in analyze_videos(videos)} if videos else set()
+            # Failures (e.g. an exhausted quota) go to the back of the queue for a later run.
+            failed_ids = [get_video_id(v["url"]) for v in videos if get_video_id(v["url"]) not in analyzed_ids]
+            save_analysis_queue(store, rest + failed_ids)
+            log_scheduler(f"Analyzed {len(analyzed_ids)} of {len(videos)} queued videos; "
+                          f"{len(rest) + len(failed_ids)} still waiting.")
+
+    def run_forever(self):
+        next_run = time.monotonic()
+        while not self._stop.is_set():
+            self.run_once()
+            # Slots missed while a run overran are collapsed into the next one instead of
+            # firing back to back.
+            now = time.monotonic()
+            next_run += self.interval
+            while next_run <= now:
+                next_run += self.interval
+            self._stop.wait(next_run - now)
+
+    def start(self):
+        # Runs the schedule in the background of serve/api.
+        threading.Thread(target=self.run_forever, name="scheduler", daemon=True).start()
+        log_scheduler(f"Scheduler started: syncing every {self.interval // 60} minutes, "
+                      f"analyzing up to {self.analyze_per_run} videos per run.")
+
+    def stop(self):
+        self._stop.set()
+
+def parse_schedule_args(args):
+    # Reads --interval <minutes> and --analyze <count>; raises ValueError on bad values.
+    interval, analyze_per_run = SCHEDULE_INTERVAL_MINUTES, SCHEDULE_ANALYZE_PER_RUN
+    try:
+        if "--interval" in args:
+            interval = int(args[args.index("--interval") + 1])
+        if "--analyze" in args:
+            analyze_per_run = int(args[args.index("--analyze") + 1])
+    except IndexError:
+        raise ValueError("missing value")
+    if interval < 1 or analyze_per_run < 0:
+        raise ValueError("--interval must be at least 1 and --analyze at least 0")
+    return Scheduler(interval, analyze_per_run)
+
+_scheduler = None # Set when serve/api run with --schedule
+
+# --- HTTP API ---
+
+API_HOST = "127.0.0.1" # Loopback only; the API has no authentication
+API_PORT = 8765
+API_MAX_BODY_BYTES = 64 * 1024 # Request bodies are small JSON objects; anything bigger is refused
+
+class ApiError(Exception):
+    def __init__(self, status, message, output=None):
+        super().__init__(message)
+        self.status = status
+        self.output = output # Captured command output, returned alongside the error
+
+def run_api_call(fn, *args, shared=False, **kwargs):
+    # Runs fn like a daemon command (one at a time, on the shared warm store) and returns
+    # (result, captured output). Known limitation: reads such as GET /playlists queue behind
+    # a long /sync too. The sync holds the exclusive data lock (flock conflicts between file
+    # descriptors even within one process) and the store's in-memory data and SQLite
+    # connection are shared, so a read cannot safely run alongside it.
+    output = io.StringIO()
+    with command_session(output, output, shared=shared):
+        result = fn(*args, **kwargs)
+    return result, output.getvalue()
+
+def require_url(params, name="url"):
+    if not isinstance(params.get(name), str) or not params[name]:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Missing '{name}' in request body")
+    return params[name]
+
+async def api_playlists(params):
+    summaries, _ = await asyncio.to_thread(run_api_call, lambda: list(get_store().playlist_summaries()), shared=True)
+    return {"playlists": [{"url": url, "added_date": added_date, "videos": total_videos, "fed": fed_videos,
+                           "unfed": total_videos - fed_videos}
+                          for url, added_date, total_videos, fed_videos in summaries]}
+
+async def api_next(params):
+    videos_to_feed, _ = await asyncio.to_thread(run_api_call, feed_next_videos)
+    if videos_to_feed is None:
+        return {"videos": [], "message": f"Already fed {DAILY_VIDEO_LIMIT} video(s) today."}
+    return {"videos": [dict(video, playlist_url=playlist_url) for video, playlist_url in videos_to_feed]}
+
+async def api_set_fed(params):
+    video_url = require_url(params)
+    video, _ = await asyncio.to_thread(run_api_call, set_video_fed, video_url)
+    if video is None:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Video {video_url} not found in any tracked playlist")
+    return {"video": video}
+
+def require_tracked_playlist(playlist_url):
+    # Runs inside run_api_call, so the store is only touched under the command lock.
+    playlist_id = get_playlist_id(playlist_url)
+    if not playlist_id:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Could not extract playlist ID from URL: {playlist_url}")
+    if get_store().get_playlist(playlist_id) is None:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Playlist {playlist_url} is not tracked")
 
-    fed_count_today = 0
-    for video_to_feed in all_unfed_videos:
-        if fed_count_today >= DAILY_VIDEO_LIMIT:
-            break
+def require_tracked_video(video_url):
+    if get_store().find_video(normalize_youtube_url(video_url)) is None:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Video {video_url} not found in any tracked playlist")
 
-        found_and_fed = False
-        for playlist_id, playlist_info in data["playlists"].items():
-            for video in playlist_info["videos"]:
-                if video["url"] == video_to_feed["url"] and not video["fed"]:
-                    print(f"Here's your next mindful video from {playlist_info['url']}:")
-                    print(f"Title: {video.get('title', 'N/A')}")
-                    print(f"URL: {video['url']}")
-                    if "summary" in video:
-                        print(f"Summary: {video['summary']}")
-                    if "usefulness_rating" in video:
-                        print(f"Usefulness: {video['usefulness_rating']}")
-                    if "actionable_points" in video and video["actionable_points"]:
-                        print("Actionable Points:")
-                        for ap in video["actionable_points"]:
-                            print(f"  - {ap}")
-                    print("\n") # Add a newline for better readability
-
-                    video["fed"] = True
-                    fed_count_today += 1
-                    found_and_fed = True
-                    break
-            if found_and_fed:
-                break
+async def api_sync(params):
+    # {"url": playlist_url} syncs one playlist; an empty body syncs them all. Failures that
+    # reach YouTube come back as 502 with the command output attached.
+    if YOUTUBE_API_KEY == "YOUR_YOUTUBE_API_KEY":
+        raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, "YouTube API key is not configured")
+    if params.get("url"):
+        playlist_url = require_url(params)
+
+        def sync_one():
+            require_tracked_playlist(playlist_url)
+            return sync_playlist(playlist_url)
+
+        new_videos, output = await asyncio.to_thread(run_api_call, sync_one)
+        if new_videos is None:
+            raise ApiError(HTTPStatus.BAD_GATEWAY, f"Sync of {playlist_url} failed", output)
+        return {"new_videos": new_videos, "output": output}
+
+    results, output = await asyncio.to_thread(run_api_call, sync_all_playlists)
+    failed = sum(1 for r in results or [] if r["status"] == "failed")
+    if results is None or (results and failed == len(results)):
+        raise ApiError(HTTPStatus.BAD_GATEWAY, "Sync failed", output)
+    return {"playlists": results, "succeeded": len(results) - failed, "failed": failed, "output": output}
+
+async def api_auto_analyze(params):
+    # {"url": video_url} analyzes one video; otherwise the auto_analyze_all options apply.
+    if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY":
+        raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, "Gemini API key is not configured")
+    refresh = bool(params.get("refresh"))
+    if params.get("url"):
+        video_url = require_url(params)
+
+        def analyze_one():
+            require_tracked_video(video_url)
+            return auto_analyze_video_with_llm(video_url, refresh)
+
+        video, output = await asyncio.to_thread(run_api_call, analyze_one)
+        if video is None:
+            raise ApiError(HTTPStatus.BAD_GATEWAY, f"Analysis of {video_url} failed", output)
+        return {"video": video, "output": output}
+
+    playlist_url = require_url(params, "playlist") if params.get("playlist") else None
+
+    def analyze_all():
+        if playlist_url:
+            require_tracked_playlist(playlist_url)
+        return auto_analyze_all(playlist_url, only_unknown=bool(params.get("unknown")), refresh=refresh,
+                                batch=bool(params.get("batch")))
+
+    counts, output = await asyncio.to_thread(run_api_call, analyze_all)
+    if counts is None or (counts[1] and not counts[0]):
+        raise ApiError(HTTPStatus.BAD_GATEWAY, "Analysis failed", output)
+    analyzed, attempted = counts
+    return {"analyzed": analyzed, "failed": attempted - analyzed, "output": output}
+
+async def api_schedule(params):
+    # Starts a scheduler run now instead of waiting for the next interval.
+    if _scheduler is None:
+        raise ApiError(HTTPStatus.CONFLICT, "Scheduler is not enabled; start the API with --schedule")
+    ran = await asyncio.to_thread(_scheduler.run_once)
+    if not ran:
+        return {"ran": False, "message": "A scheduled run is already in progress"}
+    return {"ran": True}
+
+# Path -> (method, handler). Handlers take the parsed JSON body and return a JSON-able dict.
+API_ROUTES = {
+    "/playlists": ("GET", api_playlists),
+    "/next": ("POST", api_next),
+    "/watch": ("POST", api_set_fed),
+    "/skip": ("POST", api_set_fed),
+    "/sync": ("POST", api_sync),
+    "/auto_analyze": ("POST", api_auto_analyze),
+    "/schedule": ("POST", api_schedule),
+}
 
-    if fed_count_today == 0:
-        print("No new unfed videos available across all tracked playlists. Add more playlists or sync existing ones!")
+async def dispatch_api_request(method, path, body):
+    route = API_ROUTES.get(path)
+    if route is None:
+        return HTTPStatus.NOT_FOUND, {"error": f"Unknown endpoint {path}"}
+    expected_method, handler = route
+    if method != expected_method:
+        return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{path} only accepts {expected_method}"}
+    try:
+        params = json.loads(body) if body.strip() else {}
+    except ValueError:
+        return HTTPStatus.BAD_REQUEST, {"error": "Request body is not valid JSON"}
+    if not isinstance(params, dict):
+        return HTTPStatus.BAD_REQUEST, {"error": "Request body must be a JSON object"}
+    try:
+        return HTTPStatus.OK, await handler(params)
+    except ApiError as e:
+        payload = {"error": str(e)}
+        if e.output is not None:
+            payload["output"] = e.output
+        return e.status, payload
+    except Exception as e:
+        print(f"ERROR: {method} {path} failed: {e}", file=sys.__stderr__)
+        return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
 
-    data["last_fed_date"] = today.isoformat()
-    save_data(data)
+async def handle_api_connection(reader, writer):
+    # Minimal HTTP/1.1: one request per connection, JSON in and out.
+    try:
+        request_line = await reader.readline()
+        if not request_line:
+            return
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        content_length = int(headers.get("content-length", 0))
+        if content_length < 0:
+            raise ValueError("negative Content-Length")
+        if content_length > API_MAX_BODY_BYTES:
+            status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": f"Request body over {API_MAX_BODY_BYTES} bytes"}
+        else:
+            body = await reader.readexactly(content_length)
+            status, payload = await dispatch_api_request(method, urlparse(target).path, body)
+    except (ValueError, asyncio.IncompleteReadError):
+        status, payload = HTTPStatus.BAD_REQUEST, {"error": "Malformed HTTP request"}
+    try:
+        data = json.dumps(payload).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                     "Content-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n"
+                     "Connection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+def serve_api(host=API_HOST, port=API_PORT, scheduler=None):
+    global _scheduler
+    warm_up()
+    signal.signal(signal.SIGTERM, _interrupt_on_sigterm)
+    _scheduler = scheduler
+
+    async def run():
+        server = await asyncio.start_server(handle_api_connection, host, port)
+        print(f"MindfulTube API listening on http://{host}:{port}. Press Ctrl-C to stop.", flush=True)
+        if scheduler:
+            scheduler.start()
+        async with server:
+            await server.serve_forever()
 
-# --- Main CLI Entry Point ---
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python app.py <command> [args]")
-        print("Commands:")
-        print("  add <playlist_url> - Add a YouTube playlist to track")
-        print("  list               - List all tracked playlists and their status")
-        print("  next               - Get your next mindful video (limited per day)")
-        print("  sync <playlist_url> - Sync a tracked playlist to get new videos")
-        print("  analyze <video_url> <summary> <rating> <actionable_points> - Manually add analysis for a video")
-        print("  watch <video_url>  - Mark a video as watched without feeding it")
-        print("  skip <video_url>   - Mark a video as skipped for today")
-        print("  auto_analyze <video_url> - Automatically analyze a video using LLM")
-        return
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("\nShutting down.")
 
-    command = sys.argv[1]
+# --- Main CLI Entry Point ---
+def print_usage():
+    print("Usage: python app.py <command> [args]")
+    print("Commands:")
+    print("  add <playlist_url> - Add a YouTube playlist to track")
+    print("  list               - List all tracked playlists and their status")
+    print("  next               - Get your next mindful video (limited per day)")
+    print("  sync <playlist_url> - Sync a tracked playlist to get new videos")
+    print("  sync --all         - Sync every tracked playlist in parallel")
+    print("  analyze <video_url> <summary> <rating> <actionable_points> - Manually add analysis for a video")
+    print("  watch <video_url>  - Mark a video as watched without feeding it")
+    print("  skip <video_url>   - Mark a video as skipped for today")
+    print("  auto_analyze <video_url> [--refresh] - Automatically analyze a video using LLM")
+    print("  auto_analyze_all [--playlist <playlist_url>] [--unknown] [--refresh] [--batch] - Analyze many videos in parallel using LLM")
+    print("    --refresh bypasses the cached LLM response; --batch packs short videos into shared requests")
+    print("  serve [--schedule] - Keep the library and API clients loaded and answer commands on a local socket")
+    print("  api [--host <host>] [--port <port>] [--schedule] - Serve the JSON HTTP API (default 127.0.0.1:8765)")
+    print("  schedule [--interval <minutes>] [--analyze <count>] [--once] - Sync all playlists periodically and analyze new videos")
+    print("    serve/api accept the same --interval/--analyze options with --schedule")
+
+def run_command(argv):
+    # argv has the same shape as sys.argv: [program, command, args...]
+    command = argv[1]
 
     if command == "add":
-        if len(sys.argv) < 3:
+        if len(argv) < 3:
             print("Usage: python app.py add <playlist_url>")
             return
-        playlist_url = sys.argv[2]
+        playlist_url = argv[2]
         add_playlist(playlist_url)
     elif command == "list":
         list_playlists()
     elif command == "next":
         get_next_video()
     elif command == "sync":
-        if len(sys.argv) < 3:
-            print("Usage: python app.py sync <playlist_url>")
+        if len(argv) < 3:
+            print("Usage: python app.py sync <playlist_url> | --all")
             return
-        playlist_url = sys.argv[2]
-        sync_playlist(playlist_url)
+        playlist_url = argv[2]
+        if playlist_url == "--all":
+            sync_all_playlists()
+        else:
+            sync_playlist(playlist_url)
     elif command == "analyze":
-        if len(sys.argv) < 6:
+        if len(argv) < 6:
             print("Usage: python app.py analyze <video_url> <summary> <rating> <actionable_points>")
             print("  Rating options: highly_useful, useful, fluff, outdated")
             print("  Actionable points should be separated by semicolons (;)")
             return
-        video_url = sys.argv[2]
-        summary = sys.argv[3]
-        rating = sys.argv[4]
-        actionable_points_str = sys.argv[5]
+        video_url = argv[2]
+        summary = argv[3]
+        rating = argv[4]
+        actionable_points_str = argv[5]
         analyze_video(video_url, summary, rating, actionable_points_str)
     elif command == "watch":
-        if len(sys.argv) < 3:
+        if len(argv) < 3:
             print("Usage: python app.py watch <video_url>")
             return
-        video_url = sys.argv[2]
+        video_url = argv[2]
         mark_video_watched(video_url)
     elif command == "skip":
-        if len(sys.argv) < 3:
+        if len(argv) < 3:
             print("Usage: python app.py skip <video_url>")
             return
-        video_url = sys.argv[2]
+        video_url = argv[2]
         skip_video(video_url)
     elif command == "auto_analyze":
-        if len(sys.argv) < 3:
-            print("Usage: python app.py auto_analyze <video_url>")
+        if len(argv) < 3:
+            print("Usage: python app.py auto_analyze <video_url> [--refresh]")
             return
-        video_url = sys.argv[2]
-        auto_analyze_video_with_llm(video_url)
+        video_url = argv[2]
+        auto_analyze_video_with_llm(video_url, refresh="--refresh" in argv[3:])
+    elif command == "auto_analyze_all":
+        args = argv[2:]
+        playlist_url = None
+        if "--playlist" in args:
+            i = args.index("--playlist")
+            if i + 1 >= len(args):
+                print("Usage: python app.py auto_analyze_all [--playlist <playlist_url>] [--unknown] [--refresh] [--batch]")
+                return
+            playlist_url = args[i + 1]
+        auto_analyze_all(playlist_url, only_unknown="--unknown" in args, refresh="--refresh" in args,
+                         batch="--batch" in args)
     else:
         print(f"Unknown command: {command}")
 
+def main():
+    if len(sys.argv) < 2:
+        print_usage()
+        return
+
+    command, args = sys.argv[1], sys.argv[2:]
+    if command in ("serve", "api", "schedule"):
+        try:
+            scheduler = parse_schedule_args(args) if command == "schedule" or "--schedule" in args else None
+        except ValueError as e:
+            print(f"ERROR: Invalid scheduler options: {e}", file=sys.stderr)
+            return
+    if command == "serve":
+        serve(scheduler)
+        return
+    if command == "api":
+        host, port = API_HOST, API_PORT
+        try:
+            if "--host" in args:
+                host = args[args.index("--host") + 1]
+            if "--port" in args:
+                port = int(args[args.index("--port") + 1])
+        except (IndexError, ValueError):
+            print("Usage: python app.py api [--host <host>] [--port <port>] [--schedule]")
+            return
+        serve_api(host, port, scheduler)
+        return
+    if command == "schedule":
+        if "--once" in args:
+            scheduler.run_once()
+            return
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            print("\nScheduler stopped.")
+        return
+    if run_via_daemon(sys.argv[1:]):
+        return
+
+    # Commands from parallel invocations (e.g. cron running sync while you run next) take
+    # turns on the data store; list only reads, so it can share. Opening the store may
+    # still create, migrate or import the database, so that part always runs exclusively.
+    shared = command == "list"
+    if shared:
+        with data_lock():
+            get_store()
+    with data_lock(shared=shared):
+        run_command(sys.argv)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,47 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The Google and transcript SDKs take hundreds of milliseconds to import on their own, so
+# a local command that starts importing them again blows well past this.
+STARTUP_BUDGET_SECONDS = 0.5
+HEAVY_MODULES = ("googleapiclient", "youtube_transcript_api", "google.generativeai")
+
+# Runs one command in a fresh interpreter and reports, on the last stderr line, how long
+# importing app plus the command took and which SDK modules ended up loaded.
+PROBE = """
+import json, sys, time
+command, heavy_prefixes = sys.argv[1], tuple(json.loads(sys.argv[2]))
+start = time.perf_counter()
+import app
+sys.argv = ["app.py", command]
+app.main()
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in sys.modules if m.startswith(heavy_prefixes))
+print(json.dumps({"elapsed": elapsed, "heavy": heavy}), file=sys.stderr)
+"""
+
+
+def run_local_command(command, cwd):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    result = subprocess.run([sys.executable, "-c", PROBE, command, json.dumps(HEAVY_MODULES)], cwd=cwd, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("command", ["list", "next"])
+def test_local_commands_do_not_import_sdks(command, tmp_path):
+    report = run_local_command(command, tmp_path)
+    assert report["heavy"] == []
+
+
+@pytest.mark.parametrize("command", ["list", "next"])
+def test_local_commands_start_within_budget(command, tmp_path):
+    run_local_command(command, tmp_path) # First run creates the database
+    report = run_local_command(command, tmp_path)
+    assert report["elapsed"] < STARTUP_BUDGET_SECONDS